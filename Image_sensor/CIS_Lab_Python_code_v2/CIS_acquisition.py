@@ -0,0 +1,179 @@
+'''
+Frame acquisition engine for the camera acquisition software.
+
+A background thread grabs the frames from the camera (any SensorBackend, see CIS_backends), copies
+each frame once into a preallocated ring buffer in the camera's native dtype (uint8 / uint16) and
+releases the pylon buffer right away. The measurement loops consume the frames as read-only views of the ring buffer, so no
+per-frame allocation or float64 copy happens on the main thread and the camera can run at its full
+frame rate.
+
+Usage:
+    engine = AcquisitionEngine(camera, nbrframes)
+    for frame in engine.frames():
+        stats.add(frame)        # frame is a view, only valid until the next iteration
+
+A progress(frames_done, nbrframes) callback is called after every consumed frame, and setting the
+cancel event (threading.Event) stops the acquisition with MeasurementCancelled. After max_failed
+failed grabs in a row (e.g. a disconnected camera) the acquisition stops with GrabFailed.
+
+'''
+
+import queue
+import threading
+
+import numpy as np
+
+import CIS_backends as fbackends
+
+
+class MeasurementCancelled(Exception):
+    '''raised by AcquisitionEngine.frames() when the measurement is cancelled'''
+
+
+class GrabFailed(RuntimeError):
+    '''raised by AcquisitionEngine.frames() when the camera keeps failing to deliver frames'''
+
+
+class FrameRingBuffer:
+    '''Preallocated (nslots, height, width) frame storage in native dtype'''
+
+    def __init__(self, nslots, height, width, dtype):
+        self.frames = np.empty((nslots, height, width), dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        '''mark all slots free again, so the buffer can be reused by another AcquisitionEngine'''
+        self.free = queue.Queue()     # slots the producer can write into
+        self.ready = queue.Queue()    # slots filled with a frame, in acquisition order
+        for slot in range(self.frames.shape[0]):
+            self.free.put(slot)
+
+    def view(self, slot):
+        '''read-only view of a slot, no copy'''
+        frame = self.frames[slot]
+        frame.flags.writeable = False
+        return frame
+
+
+class AcquisitionEngine:
+    '''Grab nbrframes frames on a background thread into a FrameRingBuffer
+
+    Pass the ring of a previous engine (engine.ring) to reuse its memory for a new run, e.g. for
+    every level of an exposure sweep.
+    '''
+
+    def __init__(self, camera, nbrframes, nslots=16, timeout=5000, ring=None, progress=None, cancel=None,
+                 max_failed=10):
+        self.camera = camera
+        self.backend = fbackends.as_backend(camera)
+        self.progress = progress
+        self.cancel = cancel
+        self.nbrframes = nbrframes
+        self.nslots = min(nslots, max(nbrframes, 1))
+        self.timeout = timeout
+        self.max_failed = max_failed  # consecutive failed grabs before giving up
+        self.ring = ring
+        if ring is not None:
+            ring.reset()
+        self.grabbed = 0              # frames put in the ring buffer
+        self.failed = 0               # failed grabs (GrabSucceeded() == False)
+        self._ring_ready = threading.Event()
+        self._stop = threading.Event()
+        self._error = None
+        self._started = False
+        self._thread = threading.Thread(target=self._run, name="AcquisitionEngine", daemon=True)
+
+    def start(self):
+        '''start the grabbing thread'''
+        self._started = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''stop grabbing (the frames already in the ring buffer are still delivered)'''
+        self._stop.set()
+
+    def _next_free_slot(self):
+        while not self._stop.is_set():
+            try:
+                return self.ring.free.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return None
+
+    def _run(self):
+        slot = None
+        failed_in_row = 0
+        try:
+            while self.grabbed < self.nbrframes and not self._stop.is_set():
+                # reserve the slot first so the pylon buffer is never held while waiting for the consumer
+                if slot is None and self.ring is not None:
+                    slot = self._next_free_slot()
+                    if slot is None:
+                        break
+                target = None if slot is None else self.ring.frames[slot]
+                frame = self.backend.grab(target, self.timeout)
+                if frame is None:
+                    self.failed += 1
+                    failed_in_row += 1
+                    if failed_in_row >= self.max_failed:
+                        raise GrabFailed("%d grabs in a row failed after %d frames"
+                                         % (failed_in_row, self.grabbed))
+                    continue
+                failed_in_row = 0
+                if frame is not target:
+                    # the dtype and size are only known once the first frame is in
+                    self.ring = FrameRingBuffer(self.nslots, frame.shape[0], frame.shape[1], frame.dtype)
+                    slot = self.ring.free.get()
+                    np.copyto(self.ring.frames[slot], frame)
+                self._ring_ready.set()
+                self.grabbed += 1
+                self.ring.ready.put(slot)
+                slot = None
+        except Exception as e:
+            self._error = e
+        finally:
+            self._ring_ready.set()
+            if self.ring is not None:
+                self.ring.ready.put(None)
+
+    def _check_cancel(self):
+        if self.cancel is not None and self.cancel.is_set():
+            raise MeasurementCancelled("acquisition cancelled after %d frames" % self.grabbed)
+
+    def _wait_ring_ready(self):
+        while not self._ring_ready.wait(timeout=0.1):
+            self._check_cancel()
+
+    def _next_ready_slot(self):
+        while True:
+            self._check_cancel()
+            try:
+                return self.ring.ready.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+    def frames(self):
+        '''yield the acquired frames as read-only views of the ring buffer
+
+        A view is only valid until the next frame is requested; copy it if it has to be kept.
+        '''
+        if not self._started:
+            self.start()
+        done = 0
+        try:
+            self._wait_ring_ready()
+            while self.ring is not None:
+                slot = self._next_ready_slot()
+                if slot is None:
+                    break
+                yield self.ring.view(slot)
+                self.ring.free.put(slot)
+                done += 1
+                if self.progress is not None:
+                    self.progress(done, self.nbrframes)
+        finally:
+            self.stop()
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
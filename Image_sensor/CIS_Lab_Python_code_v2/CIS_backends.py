@@ -0,0 +1,219 @@
+'''
+Sensor backends for the camera acquisition software.
+
+The acquisition engine and the measurement functions grab frames through a SensorBackend instead of
+calling pypylon directly, so the same statistics paths run on:
+    PylonBackend     a Basler camera opened with camera_open (pypylon InstantCamera)
+    SyntheticSensor  a simulated sensor (shot noise, read noise, PRNU, DSNU, full well, frame rate),
+                     to benchmark and regression test the pipelines without the lab bench
+The TC2 board backend (TC2Backend) is in Radiation_project/XRAY_files/TC2_functions.py.
+
+Functions that take a "camera" accept a pylon camera or any SensorBackend (see as_backend).
+
+'''
+
+import re
+import time
+
+import numpy as np
+
+
+class SensorBackend:
+    '''Interface of a frame source'''
+
+    name = "sensor"
+    skipped = 0     # frames the source lost before they were grabbed (overwritten in its buffers)
+    bit_depth = None    # ADC resolution [bits], None if unknown
+
+    def start(self, every_frame=False, buffers=None):
+        '''start acquisition
+
+        every_frame : deliver every frame in order (recording) instead of the latest one (preview)
+        buffers     : number of source buffers for every_frame, None for the source default
+        '''
+        return self
+
+    def stop(self):
+        '''stop acquisition'''
+        return 0
+
+    def set_exposure_time(self, exposure_time):
+        '''set the exposure time'''
+        raise NotImplementedError
+
+    def grab(self, out=None, timeout=5000):
+        '''grab one frame
+
+        Fill out (a (height, width) array of the sensor dtype) if given, or a new array. Returns the
+        filled array; a new array if out does not match the frame; None if the grab failed.
+        '''
+        raise NotImplementedError
+
+
+def as_backend(camera):
+    '''camera as a SensorBackend: backends are returned as is, pylon cameras wrapped in PylonBackend'''
+    if isinstance(camera, SensorBackend):
+        return camera
+    return PylonBackend(camera)
+
+
+def _fill(out, frame):
+    if out is None or out.shape != frame.shape or out.dtype != frame.dtype:
+        return np.array(frame, copy=True)
+    np.copyto(out, frame)
+    return out
+
+
+class PylonBackend(SensorBackend):
+    '''Basler camera through pypylon (camera from camera_open)'''
+
+    name = "pylon"
+
+    def __init__(self, camera):
+        from pypylon import pylon   # only needed with a real camera
+        self.pylon = pylon
+        self.camera = camera
+        self.every_frame = None     # strategy of the grabbing started here, None: not started here
+        self.skipped = 0
+
+    def start(self, every_frame=False, buffers=None):
+        '''start grabbing: GrabStrategy_OneByOne for every_frame, else GrabStrategy_LatestImageOnly'''
+        if self.camera.IsGrabbing():
+            if every_frame == self.every_frame or (not every_frame and self.every_frame is None):
+                return self
+            # the strategy and the buffers can only be changed while the camera is not grabbing
+            self.camera.StopGrabbing()
+        if every_frame:
+            if buffers:
+                self.camera.MaxNumBuffer.SetValue(int(buffers))
+            self.camera.StartGrabbing(self.pylon.GrabStrategy_OneByOne)
+        else:
+            self.camera.StartGrabbing(self.pylon.GrabStrategy_LatestImageOnly)
+        self.every_frame = every_frame
+        return self
+
+    def stop(self):
+        self.camera.StopGrabbing()
+        return 0
+
+    @property
+    def bit_depth(self):
+        '''ADC resolution [bits] of the pixel format, e.g. 12 for Mono12 / BayerGR12 (PixelSize Bpp12)'''
+        nodemap = self.camera.GetNodeMap()
+        for node in ("PixelSize", "PixelFormat"):
+            try:
+                value = nodemap.GetNode(node).ToString()
+            except Exception:
+                continue    # node not available on this camera
+            match = re.search(r"(\d+)[a-z]*$", value)
+            if match:
+                return int(match.group(1))
+        return None
+
+    def set_exposure_time(self, exposure_time):
+        '''exposure time [us], written in the node map loaded by camera_open'''
+        self.camera.GetNodeMap().GetNode("ExposureTime").SetValue(float(exposure_time))
+
+    def grab(self, out=None, timeout=5000):
+        grabResult = self.camera.RetrieveResult(timeout, self.pylon.TimeoutHandling_ThrowException)
+        try:
+            # frames overwritten in the pylon buffers since the previous grab
+            self.skipped += grabResult.GetNumberOfSkippedImages()
+            if not grabResult.GrabSucceeded():
+                return None
+            # view of the pylon buffer (.Array would be a copy): the frame is copied once, into out
+            with grabResult.GetArrayZeroCopy() as frame:
+                return _fill(out, frame)
+        finally:
+            grabResult.Release()
+
+
+class SyntheticSensor(SensorBackend):
+    '''Simulated image sensor
+
+    width, height     : frame size [pixels]
+    bit_depth         : ADC resolution, frames are uint8 up to 8 bits, uint16 above
+    exposure_time     : [us]
+    photon_flux       : photo electrons per pixel per us at the current illumination
+    conversion_gain   : [e-/DN]
+    read_noise        : [e- rms]
+    dark_offset       : black level [DN]
+    prnu              : photo response non uniformity (relative, rms)
+    dsnu              : dark signal non uniformity [e- rms]
+    full_well         : [e-]
+    frame_rate        : maximum frame rate [fps], None for as fast as possible
+    shot_noise        : 'gaussian' (fast, one normal draw per pixel) or 'poisson' (exact)
+    seed              : random generator seed (the fixed pattern noise maps use it too)
+
+    All random numbers of a frame are drawn in one vectorized call into preallocated float32
+    buffers, the noise std map is only recomputed when the exposure or illumination changes.
+    '''
+
+    name = "synthetic"
+
+    def __init__(self, width=1278, height=960, bit_depth=12, exposure_time=10000.0, photon_flux=0.5,
+                 conversion_gain=4.0, read_noise=3.0, dark_offset=16.0, prnu=0.01, dsnu=1.0,
+                 full_well=10000.0, frame_rate=None, shot_noise='gaussian', seed=None):
+        self.width = width
+        self.height = height
+        self.bit_depth = bit_depth
+        self.dtype = np.dtype(np.uint8 if bit_depth <= 8 else np.uint16)
+        self.conversion_gain = conversion_gain
+        self.read_noise = read_noise
+        self.dark_offset = dark_offset
+        self.full_well = full_well
+        self.frame_rate = frame_rate
+        self.shot_noise = shot_noise
+        self.rng = np.random.default_rng(seed)
+        self.frames_generated = 0
+        shape = (height, width)
+        # fixed pattern noise, drawn once
+        self.prnu_map = (1.0 + prnu * self.rng.standard_normal(shape, dtype=np.float32)).astype(np.float32)
+        self.dsnu_map = (dsnu * self.rng.standard_normal(shape, dtype=np.float32)).astype(np.float32)
+        self._noise = np.empty(shape, dtype=np.float32)
+        self._next_frame = 0.0
+        self.exposure_time = exposure_time
+        self.photon_flux = photon_flux
+        self._update_signal()
+
+    def _update_signal(self):
+        # mean signal [e-] and temporal noise [e- rms] per pixel for the current exposure
+        self.signal = (self.photon_flux * self.exposure_time) * self.prnu_map
+        self.noise_std = np.sqrt(self.signal + np.float32(self.read_noise ** 2))
+
+    def set_exposure_time(self, exposure_time):
+        '''exposure time [us]'''
+        self.exposure_time = float(exposure_time)
+        self._update_signal()
+
+    def set_illumination(self, photon_flux):
+        '''photo electrons per pixel per us'''
+        self.photon_flux = float(photon_flux)
+        self._update_signal()
+
+    def grab(self, out=None, timeout=5000):
+        if self.frame_rate:
+            delay = self._next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame = max(self._next_frame, time.monotonic()) + 1.0 / self.frame_rate
+        electrons = self._noise
+        if self.shot_noise == 'poisson':
+            electrons[...] = self.rng.poisson(self.signal)
+            electrons += self.dsnu_map
+            electrons += self.read_noise * self.rng.standard_normal(electrons.shape, dtype=np.float32)
+        else:
+            self.rng.standard_normal(dtype=np.float32, out=electrons)
+            electrons *= self.noise_std
+            electrons += self.signal
+            electrons += self.dsnu_map
+        np.clip(electrons, None, self.full_well, out=electrons)
+        electrons *= np.float32(1.0 / self.conversion_gain)
+        electrons += np.float32(self.dark_offset)
+        np.rint(electrons, out=electrons)
+        np.clip(electrons, 0, 2 ** self.bit_depth - 1, out=electrons)
+        if out is None or out.shape != electrons.shape or out.dtype != self.dtype:
+            out = np.empty(electrons.shape, dtype=self.dtype)
+        out[...] = electrons
+        self.frames_generated += 1
+        return out
@@ -0,0 +1,226 @@
+'''
+Frame stack files for the camera acquisition software.
+
+save_image used to write a bare .raw file (imraw.tofile) per frame: the shape and dtype were not
+stored, so every reader had to hardcode them (e.g. image_shape = (960,1278), dtype=np.uint16). A
+frame stack file (.fstk) describes itself and holds any number of frames:
+
+    offset 0          magic b"CISFSTK1", uint32 (little endian) length of the JSON header, header
+                      height, width, dtype, bit_depth, camera, exposure_time, created (unix time),
+                      nframes, data_offset, frame_bytes, timestamps_offset and user metadata
+    data_offset       the frames, back to back in the camera dtype, frame-major (n, height, width)
+                      (data_offset is a multiple of 4096: ImageJ opens the file as raw with this
+                      offset to the first image)
+    timestamps_offset float64 unix time of every frame, written by close()
+
+Frames are appended with plain sequential writes, so recording runs at disk speed. The reader maps
+the frames with np.memmap: indexing a frame or a ROI reads only those bytes, nothing is loaded up
+front. A file that was not closed (crash, power loss) still opens: the frames are counted from the
+file size, the timestamps are then missing.
+
+Usage:
+    with FrameStackWriter(filename, height, width, np.uint16, bit_depth=12, camera="puA1280") as stack:
+        for frame in engine.frames():
+            stack.append(frame)
+
+    stack = open_stack(filename)
+    stack[10]                     # frame 10, a view of the file
+    stack[:, 100:200, 300:400]    # ROI of every frame
+    stack.timestamps, stack.camera, stack.exposure_time, stack.header
+
+'''
+
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"CISFSTK1"
+VERSION = 1
+ALIGNMENT = 4096        # data_offset granularity (page size, ImageJ friendly)
+HEADER_SLACK = 512      # room for the header to grow when close() rewrites it
+
+
+def _header_block(header, size=None):
+    # magic + length + JSON, zero padded to size (default: the next multiple of ALIGNMENT with slack)
+    text = json.dumps(header, sort_keys=True).encode("utf-8")
+    block = MAGIC + struct.pack("<I", len(text)) + text
+    if size is None:
+        size = -(-(len(block) + HEADER_SLACK) // ALIGNMENT) * ALIGNMENT
+    if len(block) > size:
+        raise ValueError("frame stack header does not fit in %d bytes" % size)
+    return block + b"\0" * (size - len(block)), size
+
+
+class FrameStackWriter:
+    '''Append frames to a new frame stack file.
+
+    filename      : path of the file (".fstk" by convention), overwritten if it exists
+    height, width : frame size [pixels]
+    dtype         : frame dtype (camera native: uint8 / uint16), stored little endian
+    bit_depth     : ADC resolution, default the dtype size
+    camera        : camera name (cameraname of camera_frame_set)
+    exposure_time : [us]
+    metadata      : dict of other JSON serializable values stored in the header
+    '''
+
+    def __init__(self, filename, height, width, dtype, bit_depth=None, camera=None, exposure_time=None,
+                 metadata=None):
+        self.filename = filename
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.shape = (int(height), int(width))
+        self.frame_bytes = self.shape[0] * self.shape[1] * self.dtype.itemsize
+        self.nframes = 0
+        self.bytes_written = 0
+        self.timestamps = []
+        self.header = {
+            "version": VERSION,
+            "height": self.shape[0],
+            "width": self.shape[1],
+            "dtype": self.dtype.str,
+            "bit_depth": int(bit_depth) if bit_depth else 8 * self.dtype.itemsize,
+            "camera": camera,
+            "exposure_time": exposure_time,
+            "created": time.time(),
+            "nframes": 0,
+            "frame_bytes": self.frame_bytes,
+            "timestamps_offset": None,
+            "metadata": metadata or {},
+        }
+        self.header["data_offset"] = 0
+        block, size = _header_block(self.header)
+        self.header["data_offset"] = size
+        block, size = _header_block(self.header, size)
+        self.data_offset = size
+        self.file = open(filename, "wb")
+        self.file.write(block)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, frame, timestamp=None):
+        '''write one frame (timestamp: unix time, default now)'''
+        if frame.shape != self.shape:
+            raise ValueError("frame shape %s does not match stack shape %s" % (frame.shape, self.shape))
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+        # the buffer is written directly, no copy for a contiguous frame of the stack dtype
+        self.file.write(np.ascontiguousarray(frame, dtype=self.dtype).data)
+        self.nframes += 1
+        self.bytes_written += self.frame_bytes
+
+    def append_many(self, frames, timestamps=None):
+        '''write a (n, height, width) block of frames with one write call'''
+        if frames.shape[1:] != self.shape:
+            raise ValueError("frame shape %s does not match stack shape %s" % (frames.shape[1:], self.shape))
+        if timestamps is None:
+            timestamps = [time.time()] * len(frames)
+        elif len(timestamps) != len(frames):
+            raise ValueError("%d timestamps for %d frames" % (len(timestamps), len(frames)))
+        self.timestamps.extend(float(t) for t in timestamps)
+        self.file.write(np.ascontiguousarray(frames, dtype=self.dtype).data)
+        self.nframes += len(frames)
+        self.bytes_written += len(frames) * self.frame_bytes
+
+    def flush(self):
+        '''push the written frames to the operating system'''
+        self.file.flush()
+
+    def close(self):
+        '''write the timestamps and the final header, and close the file'''
+        if self.file.closed:
+            return
+        self.header["nframes"] = self.nframes
+        self.header["timestamps_offset"] = self.data_offset + self.nframes * self.frame_bytes
+        self.file.write(np.asarray(self.timestamps, dtype="<f8").tobytes())
+        block, size = _header_block(self.header, self.data_offset)
+        self.file.seek(0)
+        self.file.write(block)
+        self.file.close()
+
+
+def read_header(filename):
+    '''header dict of a frame stack file'''
+    with open(filename, "rb") as f:
+        magic = f.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("%s is not a frame stack file" % filename)
+        length, = struct.unpack("<I", f.read(4))
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+class FrameStack:
+    '''Frame stack file opened for reading (see open_stack)
+
+    Indexing and slicing go to the (nframes, height, width) memory map self.frames, so frames and
+    ROIs are views of the file that are only read when used.
+    '''
+
+    def __init__(self, filename, mode="r"):
+        self.filename = filename
+        self.header = read_header(filename)
+        h = self.header
+        self.dtype = np.dtype(h["dtype"])
+        self.shape = (h["height"], h["width"])
+        self.bit_depth = h["bit_depth"]
+        self.camera = h["camera"]
+        self.exposure_time = h["exposure_time"]
+        self.created = h["created"]
+        self.metadata = h["metadata"]
+        data_offset = h["data_offset"]
+        frame_bytes = h["frame_bytes"]
+        if h["timestamps_offset"] is None:
+            # not closed: count the complete frames in the file
+            nframes = (os.path.getsize(filename) - data_offset) // frame_bytes
+            self.timestamps = None
+        else:
+            nframes = h["nframes"]
+            self.timestamps = np.fromfile(filename, dtype="<f8", count=nframes, offset=h["timestamps_offset"])
+        self.nframes = nframes
+        if nframes:
+            self.frames = np.memmap(filename, dtype=self.dtype, mode=mode, offset=data_offset,
+                                    shape=(nframes,) + self.shape)
+        else:
+            self.frames = np.empty((0,) + self.shape, dtype=self.dtype)
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def roi(self, y0, y1, x0, x1):
+        '''(nframes, y1-y0, x1-x0) view of a region of interest in every frame'''
+        return self.frames[:, y0:y1, x0:x1]
+
+    def close(self):
+        '''release the memory map (it is unmapped once no view of it is left)'''
+        self.frames = None
+
+
+def open_stack(filename, mode="r"):
+    '''open a frame stack file; mode "r" read only, "r+" to modify frames in place, "c" copy on write'''
+    return FrameStack(filename, mode)
+
+
+def write_stack(filename, frames, **kwargs):
+    '''write a (n, height, width) array, or a single (height, width) frame, to a new frame stack file'''
+    frames = np.asarray(frames)
+    if frames.ndim == 2:
+        frames = frames[np.newaxis]
+    with FrameStackWriter(filename, frames.shape[1], frames.shape[2], frames.dtype, **kwargs) as stack:
+        stack.append_many(frames)
+    return filename
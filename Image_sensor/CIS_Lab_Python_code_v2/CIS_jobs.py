@@ -0,0 +1,70 @@
+'''
+Measurement jobs for the GUI interface.
+
+A MeasurementJob runs one of the acquire_* functions of CIS_lab_functions on a worker thread, so
+the PySimpleGUI window keeps responding during a 100+ frame capture. The job reports back to the
+window with events (window.write_event_value is thread safe):
+
+    JOB_PROGRESS   (name, frames_done, nbrframes)   at most every progress_period seconds
+    JOB_DONE       (name, result)                   result is the return value of the function
+    JOB_CANCELLED  (name, None)
+    JOB_ERROR      (name, exception)
+
+Plotting stays in the event loop (matplotlib is not thread safe): handle JOB_DONE there.
+
+'''
+
+import threading
+import time
+
+import CIS_acquisition as facq
+
+JOB_PROGRESS = '-JOB-PROGRESS-'
+JOB_DONE = '-JOB-DONE-'
+JOB_CANCELLED = '-JOB-CANCELLED-'
+JOB_ERROR = '-JOB-ERROR-'
+
+
+class MeasurementJob:
+    '''Run function(*args, progress=..., cancel=..., **kwargs) on a worker thread'''
+
+    def __init__(self, window, name, function, *args, progress_period=0.1, **kwargs):
+        self.window = window
+        self.name = name
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.progress_period = progress_period
+        self.cancel_event = threading.Event()
+        self._last_progress = 0.0
+        self._thread = threading.Thread(target=self._run, name="MeasurementJob-" + name, daemon=True)
+
+    def start(self):
+        '''start the job'''
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        '''ask the job to stop; it ends with a JOB_CANCELLED event'''
+        self.cancel_event.set()
+
+    def is_running(self):
+        '''True while the worker thread runs'''
+        return self._thread.is_alive()
+
+    def _progress(self, done, total):
+        # throttled: one event per frame would flood the event queue at high frame rates
+        now = time.monotonic()
+        if done == total or now - self._last_progress >= self.progress_period:
+            self._last_progress = now
+            self.window.write_event_value(JOB_PROGRESS, (self.name, done, total))
+
+    def _run(self):
+        try:
+            result = self.function(*self.args, progress=self._progress, cancel=self.cancel_event, **self.kwargs)
+        except facq.MeasurementCancelled:
+            self.window.write_event_value(JOB_CANCELLED, (self.name, None))
+        except Exception as e:
+            self.window.write_event_value(JOB_ERROR, (self.name, e))
+        else:
+            self.window.write_event_value(JOB_DONE, (self.name, result))
@@ -7,7 +7,6 @@ Created by: Pedro Santos - 01-2023
 
 '''
 
-from pypylon import pylon
 import cv2
 import sys
 #import imageio
@@ -15,10 +14,17 @@ import numpy as np
 from matplotlib import pyplot as plt
 import matplotlib
 matplotlib.style.use("seaborn-v0_8-bright")
-import pandas as pd
+import CIS_frame_stats as fstats
+import CIS_acquisition as facq
+import CIS_backends as fbackends
+import CIS_ptc as fptc
+import CIS_framestack as fstack
+import CIS_recorder as frec
+import CIS_results as fres
 
 def get_camera_name():
     ''' get_camera_name'''
+    from pypylon import pylon   # only needed with a real camera, the backends run without it
     tl_factory = pylon.TlFactory.GetInstance()
     devices = tl_factory.EnumerateDevices()
     device_name = []
@@ -51,6 +57,7 @@ def get_camera_name():
 
 def camera_open(nodefile):
     '''camera_open'''
+    from pypylon import pylon
     # conecting to the first available camera
     camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateFirstDevice())
     camera.Open()
@@ -61,6 +68,7 @@ def camera_open(nodefile):
 
 def start_grabbing_cont(camera):
     '''start_grabbing_cont'''
+    from pypylon import pylon
     # Grabing Continusely (video) with minimal delay
     camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
     converter = pylon.ImageFormatConverter()
@@ -69,6 +77,7 @@ def start_grabbing_cont(camera):
 
 def conv_opencv_rgb(converter):
     '''conv_opencv_rgb'''
+    from pypylon import pylon
     # converting to opencv bgr format
     converter.OutputPixelFormat = pylon.PixelType_BGR8packed
     converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
@@ -76,6 +85,7 @@ def conv_opencv_rgb(converter):
 
 def conv_opencv_bw(converter):
     '''conv_opencv_bw'''
+    from pypylon import pylon
     # converting to opencv bw format
     converter.OutputPixelFormat = pylon.PixelType_Mono8
     converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
@@ -122,6 +132,7 @@ def print_help():
     print("Commands:")
     print("  Escape :     stop program")
     print("  s(save):     save image as imag.png")
+    print("  r(ecord):    record 1000 frames to record.fstk")
     print("  v(erbose):   print some data about the acquired image")
     print("  d(ark):      acquire dark average image and display noise statistics")
     print("  h(istogram): display image histogram")
@@ -130,13 +141,73 @@ def print_help():
     return 0
 
 
-def save_image(imraw, img, filename):
-    '''save_image'''
+def save_image(imraw, img, filename, camera=None, exposure_time=None):
+    '''save_image: png of the converted image and the raw frame as a frame stack file (.fstk)'''
     cv2.imwrite(filename + ".png", img)
-    imraw.tofile(filename + ".raw")
+    fstack.write_stack(filename + ".fstk", imraw, camera=camera, exposure_time=exposure_time)
     return 0
 
 
+def record_frames(camera, filename, nbrframes, cameraname=None, queue_frames=64, progress=None, cancel=None):
+    '''record_frames: stream nbrframes frames to the frame stack file filename + ".fstk"
+
+    The frames are grabbed straight into the slots of a FrameRecorder queue and written by its
+    writer thread, so nothing is encoded or written on the grabbing loop. The camera grabs every
+    frame in order (GrabStrategy_OneByOne with queue_frames pylon buffers) while recording and goes
+    back to the latest image strategy afterwards. Frames that arrive while the queue is full and
+    frames the camera skipped (overwritten before they were grabbed, frames_skipped) are counted in
+    frames_dropped. Setting cancel ends the recording early, the file keeps the frames recorded so
+    far. Returns the recorder statistics (dict).
+    '''
+    backend = fbackends.as_backend(camera).start(every_frame=True, buffers=queue_frames)
+    skipped = backend.skipped
+    try:
+        stats = _record(backend, filename, nbrframes, cameraname, queue_frames, progress, cancel)
+    finally:
+        backend.start()
+    stats['frames_skipped'] = backend.skipped - skipped
+    stats['frames_dropped'] += stats['frames_skipped']
+    print("recorded %d frames (%d dropped) to %s, %.1f fps, %.1f MB/s" % (
+        stats['frames_recorded'], stats['frames_dropped'], stats['filename'], stats['frame_rate'],
+        stats['average_MBps']))
+    return stats
+
+
+def _record(backend, filename, nbrframes, cameraname, queue_frames, progress, cancel):
+    # grabbing loop of record_frames, returns the recorder statistics
+    first = backend.grab()
+    if first is None:
+        raise RuntimeError("grab failed, recording not started")
+    recorder = frec.FrameRecorder(filename + ".fstk", first.shape[0], first.shape[1], first.dtype,
+                                  queue_frames=queue_frames, bit_depth=backend.bit_depth,
+                                  camera=cameraname)
+    scratch = np.empty_like(first)    # grab target for frames that are dropped
+    recorder.submit(first)
+    done = 1
+    try:
+        while done < nbrframes:
+            if cancel is not None and cancel.is_set():
+                break
+            slot, buf = recorder.reserve()
+            if slot is None:
+                if backend.grab(scratch) is not None:
+                    done += 1
+                continue
+            frame = backend.grab(buf)
+            if frame is None:
+                recorder.release(slot)
+                continue
+            if frame is not buf:
+                np.copyto(buf, frame)
+            recorder.commit(slot)
+            done += 1
+            if progress is not None:
+                progress(done, nbrframes)
+    finally:
+        stats = recorder.stop()
+    return stats
+
+
 def print_verbose(grabResult, img, imraw):
     '''print_verbose'''
     print("SizeX: ", grabResult.Width)
@@ -175,6 +246,7 @@ def display_histogram(imraw):
     plt.yscale('log')
     plt.show()
     dataHist =  {'hist': hist, 'bin_edges': bin_edges, 'histmax':histmax}
+    import pandas as pd
     df = pd.DataFrame(dict([ (k,pd.Series(v)) for k,v in dataHist.items() ]))
     df.to_csv("E:\RADMEP_stuff\Semester_2_KU_Leuven\KU_Leuven_learn\Image_sensor\CIS_Lab_Python_code_v2\Save_Data\hist.csv")
 
@@ -182,12 +254,23 @@ def display_histogram(imraw):
 def measure_noise(camera, width, height, nbrframes, pix_x, pix_y):
     '''measure_noise'''
     #  define pix position to be measured by setting pix_x and pix_y
-    imgset = np.zeros((height, width, nbrframes))
-    for i in range(nbrframes):  #100 frames default
-        grabResult = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-        imgset[:, :, i] = grabResult.Array
+    imgnoise = acquire_noise(camera, width, height, nbrframes)
+    plot_noise(imgnoise, pix_x, pix_y)
+    return 0
+
+
+def acquire_noise(camera, width, height, nbrframes, progress=None, cancel=None):
+    '''acquire_noise: temporal noise image (progress(frames_done, nbrframes) callback, cancel event)'''
+    stats = fstats.FrameAccumulator(height, width)
+    engine = facq.AcquisitionEngine(camera, nbrframes, progress=progress, cancel=cancel)
+    for frame in engine.frames():  #100 frames default
+        stats.add(frame)
     #    print(i)
-    imgnoise = np.std(imgset, axis=2)
+    return stats.std()
+
+
+def plot_noise(imgnoise, pix_x, pix_y, block=True):
+    '''plot_noise'''
     print("Noise value of pixel [ ", pix_x, " ,", pix_y, "]: ", imgnoise[pix_x, pix_y])
     hist, bin_edges = np.histogram(imgnoise, bins=256)
     histmax = hist[0:255].max()
@@ -202,7 +285,7 @@ def measure_noise(camera, width, height, nbrframes, pix_x, pix_y):
     plt.plot(bin_edges[0:-1], hist)
     print("mean noise %f", np.mean(imgnoise))
     print("median noise %f", np.median(imgnoise))
-    plt.show()
+    plt.show(block=block)
     return 0
 
 
@@ -211,13 +294,18 @@ def dark_measurement(camera, width, height, nbrframes):
     print("Ready to acquire dark frames for noise measurement \n \n")
     print("Cover the lens and then - Press enter\n")
     cv2.waitKey(0)
-    darkset = np.ones((height, width, nbrframes)) * 256
-    for i in range(nbrframes):  #100 frames default
-        grabResult = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-        darkset[:, :, i] = grabResult.Array
+    return acquire_dark(camera, width, height, nbrframes)
+
+
+def acquire_dark(camera, width, height, nbrframes, progress=None, cancel=None):
+    '''acquire_dark: dark_measurement without the key prompt (progress callback, cancel event)'''
+    stats = fstats.FrameAccumulator(height, width)
+    engine = facq.AcquisitionEngine(camera, nbrframes, progress=progress, cancel=cancel)
+    for frame in engine.frames():  #100 frames default
+        stats.add(frame)
     #    print(i)
-    darkmean = np.mean(darkset, axis=2)
-    darknoise = np.std(darkset, axis=2)
+    darkmean = stats.mean
+    darknoise = stats.std()
     darkmax = np.max(darkmean)
     darkmeanmean = np.mean(darkmean)
     darkfpn = np.std(darkmean)
@@ -244,7 +332,13 @@ def dark_measurement_and_plot(camera, width, height, nbrframes):
     # darknoisemax = np.max(darknoise)
     darkmean, darknoise, darkmax, darkmeanmean, darkfpn, darknoisemean, darknoisemax = dark_measurement(camera, width,
                                                                                                         height, nbrframes)
+    plot_dark_measurement(darkmean, darknoise, darkmax, darkmeanmean, darkfpn, darknoisemean, darknoisemax)
+    return 0
+
 
+def plot_dark_measurement(darkmean, darknoise, darkmax, darkmeanmean, darkfpn, darknoisemean, darknoisemax,
+                          block=True):
+    '''plot_dark_measurement'''
     plt.figure(figsize = (20,15))
     plt.title("Dark mean image, equalized to 3x mean")
     plt.imshow(darkmean, cmap='gray', vmin=0, vmax=3 * darkmeanmean)
@@ -298,12 +392,12 @@ def dark_measurement_and_plot(camera, width, height, nbrframes):
     text = "min %3f,  mean: %3f, max : %3f, median: %3f" % (
     np.min(darknoise), np.mean(darknoise), darknoisemax, np.median(darknoise))
     plt.text(10, histmax * 0.6, text, color='blue')
-    plt.show()
+    plt.show(block=block)
     return 0
 
 
-def ptc_measurement(camera, width, height, nbrframes):
-    '''ptc_measurement'''
+def ptc_measurement(camera, width, height, nbrframes, binned=True):
+    '''ptc_measurement (binned: plot the PTC per DN bin instead of per pixel, the fit always uses all pixels)'''
     print("starting PTC measurement. Be sure to acquire dark frame first")
     # print("Cover the lens and then - Press enter\n")
     # cv2.waitKey(0)
@@ -312,31 +406,27 @@ def ptc_measurement(camera, width, height, nbrframes):
                                                                                                         nbrframes)
     print("Remove cover from the lens and then - Press enter\n")
     cv2.waitKey(0)
-    imgset = np.ones((height, width, nbrframes)) * 256
-    for i in range(nbrframes):  #100 frames default
-        grabResult = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-        imgset[:, :, i] = grabResult.Array
-    #    print(i)
-    immean = np.mean(imgset, axis=2) - darkmean
-    #            immean=np.mean(imgset,axis=2)
-    imvar = np.var(imgset, axis=2)
+    immean, imvar = acquire_ptc(camera, width, height, nbrframes, darkmean)
     print("Max value of mean image", immean.max())
     print("Max value of variance", imvar.max())
     print("Mean value of mean image", immean.mean())
     print("Mean value of variance", imvar.mean())
 
-    y1 = imvar.flatten()
-    x1 = immean.flatten()
-    #           z = np.polyfit(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten(),1)
-    z = np.polyfit(x1, y1, 1)
+    y1 = imvar.ravel()
+    x1 = immean.ravel()
+    # closed-form fits from one pass sums over all pixels, same results as np.polyfit / np.linalg.lstsq
+    z, wfit = fptc.ptc_fit(x1, y1)
+    if binned:
+        # plot the mean variance per DN bin instead of millions of single pixels
+        ptcx, ptcy = fptc.binned_ptc(immean, imvar)[:2]
+    else:
+        ptcx, ptcy = x1, y1
     print("linear fit: ax + b with a,b = ", z)
     p = np.poly1d(z)
-    x = ([0, 1, 255])
+    x = np.array([0, 1, 255])
     y = p(x)
     #            print(y)
-    x2 = x1[:, np.newaxis]
-    #  w = np.linalg.lstsq(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten())
-    w, _, _, _ = np.linalg.lstsq(x2, y1, rcond=None)
+    w = np.array([wfit])
     print("linear fit: ax with a = ", w[0])
 
     plt.figure()
@@ -344,7 +434,7 @@ def ptc_measurement(camera, width, height, nbrframes):
     plt.xlabel("Mean value [DN]")
     plt.ylabel("Variance [DN2]")
     plt.grid(True)
-    plt.plot(immean, imvar, '.b')
+    plt.plot(ptcx, ptcy, '.b')
     plt.plot(x, y, 'r')
     plt.plot(x, w * x, 'm')
     plt.ylim([0, (p([256]) * 1.25)])
@@ -363,7 +453,7 @@ def ptc_measurement(camera, width, height, nbrframes):
     plt.ylim([1, (p([256]) * 2)])
     plt.yscale('log')
     plt.xscale('log')
-    plt.plot(immean, imvar, '.b')
+    plt.plot(ptcx, ptcy, '.b')
     #            plt.plot(x,y,'r')
     plt.plot(x, w * x, 'm')
     ypos = (plt.gca().get_ylim())[1]
@@ -376,16 +466,13 @@ def ptc_measurement(camera, width, height, nbrframes):
 
     y1r = imvar[150:200:2, 200:250:2].flatten()
     x1r = immean[150:200:2, 200:250:2].flatten()
-    #           zr = np.polyfit(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten(),1)
-    zr = np.polyfit(x1r, y1r, 1)
+    zr, wrfit = fptc.ptc_fit(x1r, y1r)
     print("linear fit in ROI: ax + b with a,b = ", zr)
     pr = np.poly1d(zr)
-    xr = ([0, 255])
+    xr = np.array([0, 255])
     yr = pr(xr)
     #            print(yr)
-    x2r = x1r[:, np.newaxis]
-    #            w = np.linalg.lstsq(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten())
-    wr, _, _, _ = np.linalg.lstsq(x2r, y1r, rcond=None)
+    wr = np.array([wrfit])
     print("linear fit in ROI: ax with a = ", wr[0])
 
     plt.figure()
@@ -434,8 +521,8 @@ def ptc_measurement(camera, width, height, nbrframes):
     plt.show()
 
 
-def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, darkmax, darkmeanmean, darkfpn, darknoisemean, darknoisemax):
-    '''ptc_measurement for the GUI'''
+def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, darkmax, darkmeanmean, darkfpn, darknoisemean, darknoisemax, binned=True):
+    '''ptc_measurement for the GUI (binned: plot the PTC per DN bin instead of per pixel, see ptc_analysis_GUI)'''
     # print("starting PTC measurement. Be sure to acquire dark frame first")
     # # print("Cover the lens and then - Press enter\n")
     # # cv2.waitKey(0)
@@ -444,31 +531,50 @@ def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, d
     #                                                                                                     nbrframes)
     print("Remove cover from the lens and then - Press enter\n")
     cv2.waitKey(0)
-    imgset = np.ones((height, width, nbrframes)) * 256
-    for i in range(nbrframes):  #100 frames default
-        grabResult = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-        imgset[:, :, i] = grabResult.Array
+    immean, imvar = acquire_ptc(camera, width, height, nbrframes, darkmean)
+    ptc_analysis_GUI(immean, imvar, binned)
+
+
+def acquire_ptc(camera, width, height, nbrframes, darkmean, progress=None, cancel=None):
+    '''acquire_ptc: dark corrected mean image and variance image (progress callback, cancel event)'''
+    # frames kept in the camera dtype (uint8/uint16), frame-major so each frame is one contiguous write
+    imgset = None
+    engine = facq.AcquisitionEngine(camera, nbrframes, progress=progress, cancel=cancel)
+    for i, frame in enumerate(engine.frames()):  #100 frames default
+        if imgset is None:
+            imgset = np.empty((nbrframes, height, width), dtype=frame.dtype)
+        imgset[i] = frame
     #    print(i)
-    immean = np.mean(imgset, axis=2) - darkmean
-    #            immean=np.mean(imgset,axis=2)
-    imvar = np.var(imgset, axis=2)
+    immean, imvar = fstats.stack_mean_var(imgset)
+    immean -= darkmean
+    return immean, imvar
+
+
+def ptc_analysis_GUI(immean, imvar, binned=True):
+    '''PTC fits and plots of ptc_measurement_GUI, on the mean and variance images of acquire_ptc
+
+    The fits use every pixel; binned only reduces the plotted points to one per DN bin.
+    '''
     print("Max value of mean image", immean.max())
     print("Max value of variance", imvar.max())
     print("Mean value of mean image", immean.mean())
     print("Mean value of variance", imvar.mean())
 
-    y1 = imvar.flatten()
-    x1 = immean.flatten()
-    #           z = np.polyfit(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten(),1)
-    z = np.polyfit(x1, y1, 1)
+    y1 = imvar.ravel()
+    x1 = immean.ravel()
+    # closed-form fits from one pass sums over all pixels, same results as np.polyfit / np.linalg.lstsq
+    z, wfit = fptc.ptc_fit(x1, y1)
+    if binned:
+        # plot the mean variance per DN bin instead of millions of single pixels
+        ptcx, ptcy = fptc.binned_ptc(immean, imvar)[:2]
+    else:
+        ptcx, ptcy = x1, y1
     print("linear fit: ax + b with a,b = ", z)
     p = np.poly1d(z)
-    x = ([0, 1, 255])
+    x = np.array([0, 1, 255])
     y = p(x)
     #            print(y)
-    x2 = x1[:, np.newaxis]
-    #  w = np.linalg.lstsq(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten())
-    w, _, _, _ = np.linalg.lstsq(x2, y1, rcond=None)
+    w = np.array([wfit])
     print("linear fit: ax with a = ", w[0])
 
     fig1 = plt.figure(figsize=(8,6))
@@ -476,7 +582,7 @@ def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, d
     plt.xlabel("Mean value [DN]")
     plt.ylabel("Variance [DN$^2$]")
     plt.grid(True)
-    plt.plot(immean, imvar, '.b')
+    plt.plot(ptcx, ptcy, '.b')
     plt.plot(x, y, 'r')
     plt.plot(x, w * x, 'm')
     plt.ylim([0, (p([256]) * 10)]) # default times 1.25
@@ -495,7 +601,7 @@ def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, d
     plt.ylim([0.1, (p([256]) * 20)]) # default times 2
     plt.yscale('log')
     plt.xscale('log')
-    plt.plot(immean, imvar, '.b')
+    plt.plot(ptcx, ptcy, '.b')
     #            plt.plot(x,y,'r')
     plt.plot(x, w * x, 'm')
     ypos = (plt.gca().get_ylim())[1]
@@ -508,16 +614,13 @@ def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, d
 
     y1r = imvar[150:200:2, 200:250:2].flatten()
     x1r = immean[150:200:2, 200:250:2].flatten()
-    #           zr = np.polyfit(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten(),1)
-    zr = np.polyfit(x1r, y1r, 1)
+    zr, wrfit = fptc.ptc_fit(x1r, y1r)
     print("linear fit in ROI: ax + b with a,b = ", zr)
     pr = np.poly1d(zr)
-    xr = ([0, 255])
+    xr = np.array([0, 255])
     yr = pr(xr)
     #            print(yr)
-    x2r = x1r[:, np.newaxis]
-    #            w = np.linalg.lstsq(imvar[400:500:2,500:600:2].flatten(),immean[400:500:2,500:600:2].flatten())
-    wr, _, _, _ = np.linalg.lstsq(x2r, y1r, rcond=None)
+    wr = np.array([wrfit])
     print("linear fit in ROI: ax with a = ", wr[0])
 
     #plt.figure()
@@ -566,9 +669,10 @@ def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, d
     print(y)
     print(w*x)
     print(p([256]))
-    dataPTC = {'immean': immean.flatten(), 'imvar': imvar.flatten(), 'x': x, 'y':y, 'wx': w*x, 'p': p([256])}
-    df = pd.DataFrame(dict([ (k,pd.Series(v)) for k,v in dataPTC.items() ]))
-    df.to_csv('E:\RADMEP_stuff\Semester_2_KU_Leuven\KU_Leuven_learn\Image_sensor\CIS_Lab_Python_code_v2\Save_Data\PTC_stuff.csv')
+    # binary results file, read back with CIS_results.load_results (Image_sensor_PTC.ipynb)
+    fres.save_results('E:\RADMEP_stuff\Semester_2_KU_Leuven\KU_Leuven_learn\Image_sensor\CIS_Lab_Python_code_v2\Save_Data\PTC_stuff.npz',
+                      immean=immean, imvar=imvar, x=x, y=y, wx=w*x, p=p([256]), ptcx=ptcx, ptcy=ptcy,
+                      metadata={'fit': z, 'fit_through_zero': wfit, 'binned': binned})
     
     # This part of the code causes error
     #plt.figure()
@@ -576,3 +680,73 @@ def ptc_measurement_GUI(camera, width, height, nbrframes, darkmean, darknoise, d
     #plt.hist2d(x1, y1, bins=(256, 256), range=([0, 255], [0, prl]), cmap=plt.cm.jet)
     #plt.colorbar()
     #plt.show()
+
+
+def set_exposure_time(camera, exposure_time):
+    '''set_exposure_time [us] in the node map loaded by camera_open (or of a SensorBackend)'''
+    fbackends.as_backend(camera).set_exposure_time(exposure_time)
+    return 0
+
+
+def ptc_sweep(camera, width, height, nbrframes, exposure_times, darkmean, darknoise, settle_frames=2):
+    '''ptc_sweep
+
+    Step the exposure time through exposure_times [us] and stream nbrframes frames per level.
+    Acquire the dark frames first (dark_measurement) with the lens covered; the sweep itself needs
+    a constant, uniform illumination. Only the per-pixel accumulator and the ring buffer are kept in
+    memory, both reused for every level.
+    '''
+    nlevels = len(exposure_times)
+    signal = np.zeros(nlevels)
+    variance = np.zeros(nlevels)
+    stats = fstats.FrameAccumulator(height, width)
+    ring = None
+    for k, exposure_time in enumerate(exposure_times):
+        set_exposure_time(camera, exposure_time)
+        stats.reset()
+        engine = facq.AcquisitionEngine(camera, nbrframes + settle_frames, ring=ring)
+        for i, frame in enumerate(engine.frames()):
+            if i >= settle_frames:   # frames already in flight were exposed with the previous setting
+                stats.add(frame)
+        ring = engine.ring
+        signal[k] = np.mean(stats.mean) - np.mean(darkmean)
+        variance[k] = np.mean(stats.var())
+        print("exposure %.1f us: mean %f DN, variance %f DN2" % (exposure_time, signal[k], variance[k]))
+
+    ptc = fptc.ptc_sweep_analysis(exposure_times, signal, variance, np.mean(np.square(darknoise)))
+    print("conversion gain: %f e-/DN" % ptc['conversion_gain'])
+    print("read noise: %f DN rms, %f e- rms" % (ptc['read_noise_dn'], ptc['read_noise_e']))
+    print("full well: %f DN, %f e-" % (ptc['full_well_dn'], ptc['full_well_e']))
+    print("linearity error: %f %%" % ptc['linearity_error'])
+    return ptc
+
+
+def plot_ptc_sweep(ptc):
+    '''plot_ptc_sweep'''
+    fit = ptc['fit_levels']
+    x = np.array([0, ptc['full_well_dn']])
+
+    plt.figure(figsize=(8, 6))
+    plt.title("PTC curve - exposure sweep")
+    plt.xlabel("Mean value [DN]")
+    plt.ylabel("Variance [DN$^2$]")
+    plt.grid(True)
+    plt.plot(ptc['signal'], ptc['variance'], 'ob')
+    plt.plot(ptc['signal'][fit], ptc['variance'][fit], 'or')
+    plt.plot(x, ptc['ptc_slope'] * x + ptc['ptc_offset'], 'r')
+    text = "conversion gain %3f e-/DN, read noise %3f e-, full well %3f e-" % (
+        ptc['conversion_gain'], ptc['read_noise_e'], ptc['full_well_e'])
+    plt.text(0, plt.gca().get_ylim()[1] * 0.9, text, fontsize=10, color='r')
+    plt.show(block=False)
+
+    plt.figure(figsize=(8, 6))
+    plt.title("Linearity - exposure sweep")
+    plt.xlabel("Exposure time [us]")
+    plt.ylabel("Mean value [DN]")
+    plt.grid(True)
+    plt.plot(ptc['exposure_times'], ptc['signal'], 'ob')
+    plt.plot(ptc['exposure_times'], ptc['linearity_slope'] * ptc['exposure_times'] + ptc['linearity_offset'], 'r')
+    text = "linearity error %3f %%" % ptc['linearity_error']
+    plt.text(0, plt.gca().get_ylim()[1] * 0.9, text, fontsize=10, color='r')
+    plt.show()
+    return 0
@@ -0,0 +1,119 @@
+'''
+Live preview for the GUI interface.
+
+The GUI event loop used to retrieve, resize and PNG encode every preview frame itself, which capped
+the preview at ~5-10 fps and froze the buttons while encoding. PreviewWorker grabs on its own
+thread at a capped rate, downscales the frame and stores it as raw PPM/PGM bytes (a header and the
+pixels, which tkinter displays without decoding a compressed format). The event loop only picks up
+the latest frame.
+
+Usage:
+    preview = PreviewWorker(camera, converter).start()
+    seq, imgbytes, img, imraw, width, height = preview.latest()
+    preview.pause()  /  preview.resume()    # around anything else that retrieves frames
+    preview.stop()
+
+'''
+
+import threading
+import time
+
+from pypylon import pylon
+import cv2
+
+
+def ppm_bytes(img):
+    '''encode a mono (PGM) or BGR (PPM) uint8 image as raw netpbm bytes'''
+    if img.ndim == 2:
+        header = b"P5\n%d %d\n255\n" % (img.shape[1], img.shape[0])
+    else:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        header = b"P6\n%d %d\n255\n" % (img.shape[1], img.shape[0])
+    return header + img.tobytes()
+
+
+class PreviewWorker:
+    '''Grab, downscale and encode preview frames on a background thread'''
+
+    def __init__(self, camera, converter, display_size=(1280, 960), max_fps=15, timeout=5000):
+        self.camera = camera
+        self.converter = converter
+        self.display_size = display_size
+        self.period = 1.0 / max_fps
+        self.timeout = timeout
+        self.frames_displayed = 0
+        self.error = None
+        self._latest = (0, None, None, None, 0, 0)
+        self._lock = threading.Lock()           # protects self._latest
+        self._camera_lock = threading.Lock()    # held while the thread uses the camera
+        self._running = threading.Event()
+        self._running.set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="PreviewWorker", daemon=True)
+
+    def start(self):
+        '''start the preview thread'''
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''stop the preview thread and wait for it'''
+        self._stop.set()
+        self._running.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def pause(self):
+        '''stop grabbing; returns once the thread no longer uses the camera'''
+        self._running.clear()
+        with self._camera_lock:
+            pass
+
+    def resume(self):
+        '''resume grabbing after pause()'''
+        self._running.set()
+
+    def latest(self):
+        '''(seq, imgbytes, img, imraw, width, height) of the latest frame, seq increments per frame'''
+        with self._lock:
+            return self._latest
+
+    def _grab(self):
+        grabResult = self.camera.RetrieveResult(self.timeout, pylon.TimeoutHandling_ThrowException)
+        try:
+            if not grabResult.GrabSucceeded():
+                return None
+            imraw = grabResult.Array
+            img = self.converter.Convert(grabResult).GetArray()
+            return imraw, img, grabResult.Width, grabResult.Height
+        finally:
+            grabResult.Release()
+
+    def _run(self):
+        next_frame = time.monotonic()
+        while not self._stop.is_set():
+            self._running.wait()
+            if self._stop.is_set():
+                break
+            # cap the rate: the camera keeps only the latest image, so sleeping loses nothing
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_frame = max(next_frame + self.period, time.monotonic())
+            with self._camera_lock:
+                if not self._running.is_set():
+                    continue
+                try:
+                    grabbed = self._grab()
+                except Exception as e:
+                    self.error = e
+                    time.sleep(self.period)
+                    continue
+            if grabbed is None:
+                continue
+            imraw, img, width, height = grabbed
+            img_lres = cv2.resize(img, self.display_size, interpolation=cv2.INTER_AREA)
+            imgbytes = ppm_bytes(img_lres)
+            with self._lock:
+                self._latest = (self._latest[0] + 1, imgbytes, img, imraw, width, height)
+            self.frames_displayed += 1
@@ -0,0 +1,142 @@
+'''
+Photon transfer curve (PTC) analysis for the camera acquisition software.
+
+PTCSums fits the PTC of a flat field (per-pixel mean vs variance) from the closed-form sufficient
+statistics n, sum(x), sum(y), sum(x*x), sum(x*y) gathered in one pass, instead of np.polyfit and
+np.linalg.lstsq over millions of flattened pixels. binned_ptc reduces the pixels to the mean
+variance per DN bin, which is what gets plotted in binned mode (the fit stays on the pixels: a fit
+of the bin means only approximates it).
+
+ptc_sweep_analysis turns the per-level statistics of an exposure sweep (one mean signal and one
+mean temporal variance per exposure time) into the sensor parameters of the full PTC:
+conversion gain, read noise, full well and linearity.
+
+'''
+
+import numpy as np
+
+
+class PTCSums:
+    '''Sufficient statistics for the linear (y = a x + b) and proportional (y = w x) PTC fits
+
+    Data can be added in several chunks, optionally weighted (e.g. with the pixel count of a bin).
+    '''
+
+    def __init__(self):
+        self.n = 0.0
+        self.sx = 0.0
+        self.sy = 0.0
+        self.sxx = 0.0
+        self.sxy = 0.0
+
+    def add(self, x, y, weights=None):
+        '''add the (x, y) pairs, any shape, in one pass'''
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        if weights is None:
+            self.n += x.size
+            self.sx += np.sum(x)
+            self.sy += np.sum(y)
+            self.sxx += np.dot(x, x)
+            self.sxy += np.dot(x, y)
+        else:
+            weights = np.asarray(weights, dtype=float).ravel()
+            wx = weights * x
+            self.n += np.sum(weights)
+            self.sx += np.sum(wx)
+            self.sy += np.dot(weights, y)
+            self.sxx += np.dot(wx, x)
+            self.sxy += np.dot(wx, y)
+        return self
+
+    def linear_fit(self):
+        '''[a, b] of y = a x + b, same as np.polyfit(x, y, 1)'''
+        den = self.n * self.sxx - self.sx * self.sx
+        if den == 0:
+            raise ValueError("linear fit is undefined: all x values are equal")
+        a = (self.n * self.sxy - self.sx * self.sy) / den
+        b = (self.sy - a * self.sx) / self.n
+        return np.array([a, b])
+
+    def proportional_fit(self):
+        '''w of y = w x, same as np.linalg.lstsq(x[:, np.newaxis], y)'''
+        if self.sxx == 0:
+            raise ValueError("proportional fit is undefined: all x values are 0")
+        return self.sxy / self.sxx
+
+
+def ptc_fit(immean, imvar, weights=None):
+    '''linear fit [a, b] and proportional fit w of the variance vs mean PTC, in one pass'''
+    sums = PTCSums().add(immean, imvar, weights)
+    return sums.linear_fit(), sums.proportional_fit()
+
+
+def binned_ptc(immean, imvar, bin_width=1.0, min_count=1):
+    '''binned_ptc
+
+    Group the pixels in bins of bin_width DN of their mean value and return, per non empty bin with
+    at least min_count pixels, the mean of the pixel means, the mean of the variances and the pixel
+    count. A few hundred points instead of millions to fit and to plot.
+    '''
+    x = np.asarray(immean, dtype=float).ravel()
+    y = np.asarray(imvar, dtype=float).ravel()
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not np.all(valid):
+        x, y = x[valid], y[valid]
+    if x.size == 0:
+        return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+    index = np.floor((x - x.min()) / bin_width).astype(np.intp)
+    counts = np.bincount(index)
+    xsum = np.bincount(index, weights=x)
+    ysum = np.bincount(index, weights=y)
+    keep = counts >= max(min_count, 1)
+    counts = counts[keep]
+    return xsum[keep] / counts, ysum[keep] / counts, counts
+
+
+def ptc_sweep_analysis(exposure_times, signal, variance, dark_variance, fit_max_fraction=0.7):
+    '''ptc_sweep_analysis
+
+    exposure_times : exposure time of each level [us]
+    signal         : dark corrected mean signal of each level [DN]
+    variance       : mean temporal variance of each level [DN^2]
+    dark_variance  : mean temporal variance of the dark frames [DN^2]
+    fit_max_fraction: the shot noise and linearity fits only use the levels below this fraction of
+                      the full well signal
+
+    The full well is the signal of the level with the largest variance (the variance collapses when
+    the pixels saturate). The slope K [DN/e-] of variance = K * signal + offset over the shot noise
+    limited levels gives the conversion gain 1/K [e-/DN].
+    '''
+    exposure_times = np.asarray(exposure_times, dtype=float)
+    signal = np.asarray(signal, dtype=float)
+    variance = np.asarray(variance, dtype=float)
+    if not (exposure_times.shape == signal.shape == variance.shape):
+        raise ValueError("exposure_times, signal and variance must have one value per level")
+    if signal.size < 2:
+        raise ValueError("a PTC sweep needs at least 2 exposure levels")
+
+    order = np.argsort(exposure_times)
+    exposure_times, signal, variance = exposure_times[order], signal[order], variance[order]
+
+    ifull = int(np.argmax(variance))
+    full_well_dn = signal[ifull]
+    fit = (np.arange(signal.size) <= ifull) & (signal <= fit_max_fraction * full_well_dn)
+    if np.count_nonzero(fit) < 2:
+        fit = np.arange(signal.size) <= max(ifull, 1)
+
+    slope, offset = np.polyfit(signal[fit], variance[fit], 1)
+    conversion_gain = 1.0 / slope                                 # e-/DN
+    read_noise_dn = np.sqrt(dark_variance)
+
+    lin_slope, lin_offset = np.polyfit(exposure_times[fit], signal[fit], 1)
+    lin_residual = signal - (lin_slope * exposure_times + lin_offset)
+    linearity_error = 100.0 * np.max(np.abs(lin_residual[fit])) / np.max(signal[fit])
+
+    return {'exposure_times': exposure_times, 'signal': signal, 'variance': variance, 'fit_levels': fit,
+            'ptc_slope': slope, 'ptc_offset': offset,
+            'conversion_gain': conversion_gain,
+            'read_noise_dn': read_noise_dn, 'read_noise_e': read_noise_dn * conversion_gain,
+            'full_well_dn': full_well_dn, 'full_well_e': full_well_dn * conversion_gain,
+            'linearity_slope': lin_slope, 'linearity_offset': lin_offset,
+            'linearity_residual': lin_residual, 'linearity_error': linearity_error}
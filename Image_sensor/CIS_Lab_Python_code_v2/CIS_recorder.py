@@ -0,0 +1,154 @@
+'''
+Continuous recording to disk for the camera acquisition software.
+
+Saving with save_image encodes a PNG and writes the raw file on the grabbing thread, so a burst
+capture loses every frame that arrives while the encoder runs. FrameRecorder decouples the two: the
+grabbing loop hands each frame to a bounded queue of preallocated slots (in the camera dtype, frames
+are grabbed straight into a slot), and a writer thread appends runs of consecutive slots to a frame
+stack file (CIS_framestack) with one large sequential write per run. When the disk falls behind and
+the queue is full the frame is dropped and counted, the grabbing never waits for the disk.
+
+Usage:
+    recorder = FrameRecorder(filename, height, width, np.uint16, camera="puA1280")
+    for ...:
+        slot, buf = recorder.reserve()          # None, None: queue full
+        frame = backend.grab(buf)               # or recorder.submit(frame) (one copy)
+        recorder.commit(slot)
+    stats = recorder.stop()     # frames_recorded, frames_dropped, bytes_written, write_MBps, ...
+
+'''
+
+import queue
+import threading
+import time
+
+import numpy as np
+
+import CIS_framestack as fstack
+
+_STOP = -1      # end of recording marker on the ready queue
+
+
+class FrameRecorder:
+    '''Record frames to a frame stack file with a bounded queue and a writer thread
+
+    queue_frames : slots of the queue (memory: queue_frames * frame size)
+    batch_frames : maximum frames per write call
+    other arguments are passed to CIS_framestack.FrameStackWriter
+    '''
+
+    def __init__(self, filename, height, width, dtype, queue_frames=64, batch_frames=16, **kwargs):
+        self.writer = fstack.FrameStackWriter(filename, height, width, dtype, **kwargs)
+        self.slots = np.empty((queue_frames, height, width), dtype=self.writer.dtype)
+        self.timestamps = np.zeros(queue_frames)
+        self.batch_frames = batch_frames
+        self.free = queue.Queue()      # slots the grabbing loop can fill, in ring order
+        self.ready = queue.Queue()     # filled slots, in acquisition order
+        for slot in range(queue_frames):
+            self.free.put(slot)
+        self.frames_recorded = 0       # frames written to the file
+        self.frames_dropped = 0        # frames lost because the queue was full
+        self.bytes_written = 0
+        self.write_time = 0.0          # seconds spent in write calls
+        self.max_queued = 0            # high water mark of the queue
+        self.error = None
+        self._start = time.monotonic()
+        self._elapsed = None
+        self._thread = threading.Thread(target=self._run, name="FrameRecorder", daemon=True)
+        self._thread.start()
+
+    def reserve(self):
+        '''(slot, buffer) to grab the next frame into, (None, None) if the queue is full (frame dropped)'''
+        self._check()
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.frames_dropped += 1
+            return None, None
+        return slot, self.slots[slot]
+
+    def commit(self, slot, timestamp=None):
+        '''queue a slot filled by the caller for writing'''
+        self.timestamps[slot] = time.time() if timestamp is None else timestamp
+        self.ready.put(slot)
+        self.max_queued = max(self.max_queued, len(self.slots) - self.free.qsize())
+
+    def release(self, slot):
+        '''give a reserved slot back without writing it (e.g. failed grab)'''
+        self.free.put(slot)
+
+    def submit(self, frame, timestamp=None):
+        '''copy a frame into the queue; False if it was dropped because the queue is full'''
+        slot, buf = self.reserve()
+        if slot is None:
+            return False
+        np.copyto(buf, frame)
+        self.commit(slot, timestamp)
+        return True
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        pending = None
+        try:
+            while True:
+                slot = self.ready.get() if pending is None else pending
+                pending = None
+                if slot == _STOP:
+                    break
+                # a run of consecutive slots is contiguous in memory: one write call
+                first = last = slot
+                while last - first + 1 < self.batch_frames and last + 1 < len(self.slots):
+                    try:
+                        nxt = self.ready.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt != last + 1:
+                        pending = nxt
+                        break
+                    last = nxt
+                start = time.perf_counter()
+                self.writer.append_many(self.slots[first:last + 1], self.timestamps[first:last + 1])
+                self.write_time += time.perf_counter() - start
+                count = last - first + 1
+                self.frames_recorded += count
+                self.bytes_written += count * self.writer.frame_bytes
+                for s in range(first, last + 1):
+                    self.free.put(s)
+        except Exception as e:
+            self.error = e
+            # reserve() raises the error from now on; drain the queue so stop() does not block
+            while True:
+                slot = self.ready.get() if pending is None else pending
+                pending = None
+                if slot == _STOP:
+                    break
+                self.free.put(slot)
+
+    def stop(self):
+        '''write the queued frames, close the file and return the statistics'''
+        if self._elapsed is None:
+            self.ready.put(_STOP)
+            self._thread.join()
+            self.writer.close()
+            self._elapsed = time.monotonic() - self._start
+        self._check()
+        return self.stats()
+
+    def stats(self):
+        '''recording statistics (dict)'''
+        elapsed = self._elapsed if self._elapsed is not None else time.monotonic() - self._start
+        mbytes = self.bytes_written / 2 ** 20
+        return {
+            "filename": self.writer.filename,
+            "frames_recorded": self.frames_recorded,
+            "frames_dropped": self.frames_dropped,
+            "bytes_written": self.bytes_written,
+            "elapsed_s": elapsed,
+            "frame_rate": self.frames_recorded / elapsed if elapsed > 0 else 0.0,
+            "write_MBps": mbytes / self.write_time if self.write_time > 0 else 0.0,   # disk throughput
+            "average_MBps": mbytes / elapsed if elapsed > 0 else 0.0,                 # sustained rate
+            "max_queued": self.max_queued,
+        }
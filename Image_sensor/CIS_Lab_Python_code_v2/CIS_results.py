@@ -0,0 +1,111 @@
+'''
+Binary results store for the measurement scripts.
+
+Measurement results used to be written as text: np.savetxt CSVs with %.18e for every TC2 map, and
+the PTC data (millions of immean / imvar points) through a pandas DataFrame of Series, padded with
+NaN to a common length and read back with pd.read_csv(...).dropna(). A results file is an .npz
+archive instead: one array per dataset, in its own dtype and shape, plus a JSON metadata record.
+Writing or loading a multi-million point PTC dump takes milliseconds, and datasets of different
+lengths need no padding.
+
+Usage:
+    save_results("PTC_stuff.npz", immean=immean, imvar=imvar, metadata={"camera": "puA1280"})
+
+    results = load_results("PTC_stuff.npz")
+    results["immean"], results.metadata, list(results)
+
+Only numeric / string arrays are stored (no pickles), so a results file is safe to open.
+
+'''
+
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+METADATA_KEY = "__metadata__"
+
+
+def _json_default(value):
+    # numpy scalars and small arrays in the metadata
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("metadata value %r is not JSON serializable" % (value,))
+
+
+def save_results(filename, metadata=None, compressed=False, **datasets):
+    '''save_results: write the datasets (name=array) and a metadata dict to an .npz results file
+
+    compressed=True zlib-compresses the datasets (smaller, slower). The file is written next to
+    the target and renamed, so an interrupted write never leaves a truncated results file.
+    '''
+    if METADATA_KEY in datasets:
+        raise ValueError("%s is reserved for the metadata" % METADATA_KEY)
+    arrays = {name: np.asarray(value) for name, value in datasets.items()}
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise TypeError("dataset %s has dtype object, only numeric and string arrays are stored" % name)
+    arrays[METADATA_KEY] = np.array(json.dumps(metadata or {}, default=_json_default))
+    tmpname = filename + ".tmp"
+    with open(tmpname, "wb") as f:
+        if compressed:
+            np.savez_compressed(f, **arrays)
+        else:
+            np.savez(f, **arrays)
+    os.replace(tmpname, filename)
+    return filename
+
+
+class Results(Mapping):
+    '''Results file opened with load_results: a read-only mapping name -> array, plus metadata
+
+    Datasets are read from the file on first access and cached.
+    '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._npz = np.load(filename, allow_pickle=False)
+        self._cache = {}
+        if METADATA_KEY in self._npz.files:
+            self.metadata = json.loads(str(self._npz[METADATA_KEY]))
+        else:
+            self.metadata = {}
+        self._names = [name for name in self._npz.files if name != METADATA_KEY]
+
+    def __getitem__(self, name):
+        if name not in self._cache:
+            if name not in self._names:
+                raise KeyError(name)
+            self._cache[name] = self._npz[name]
+        return self._cache[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load(self):
+        '''read every dataset, returns a plain dict'''
+        return {name: self[name] for name in self._names}
+
+    def close(self):
+        '''close the file (datasets already read stay available)'''
+        self._npz.close()
+
+    def __repr__(self):
+        return "Results(%r, datasets=%s)" % (self.filename, self._names)
+
+
+def load_results(filename):
+    '''load_results: open an .npz results file written by save_results'''
+    return Results(filename)
@@ -6,10 +6,10 @@ Update: Pedro Santos - 01-2023
 
 '''
 
-from pypylon import pylon
 import os
 import CIS_lab_functions as fcis
-import cv2
+import CIS_preview as fpreview
+import CIS_jobs as fjobs
 import PySimpleGUI as sg
 
 
@@ -35,6 +35,7 @@ options = [[sg.Text(" ", font='Helvetica 14')],
            [sg.Button('Image data info', size=(15, 1), font='Helvetica 14')],
            [sg.Button('Save Image', size=(15, 1), font='Helvetica 14'), sg.InputText("Imraw",
                                                                                     size=(15, 1), font='Helvetica 12')],
+           [sg.Button('Record', size=(15, 1), font='Helvetica 14')],
            [sg.Text(" ", font='Helvetica 14')],
            [sg.HorizontalSeparator()],
            [sg.Text(" Image processing functions", font='Helvetica 14')],
@@ -46,6 +47,9 @@ options = [[sg.Text(" ", font='Helvetica 14')],
            [sg.Button('Dark', size=(15, 1), font='Helvetica 14')],
            [sg.Button('Noise', size=(15, 1), font='Helvetica 14')],
            [sg.Button('PTC', size=(15, 1), font='Helvetica 14')],
+           [sg.Button('Cancel', size=(15, 1), font='Helvetica 14')],
+           [sg.ProgressBar(100, orientation='h', size=(25, 15), key='-PROGRESS-')],
+           [sg.Text(' --- idle ---', size=(30, 1), key='-JOBSTATUS-')],
            ]
 
 cwd = os.getcwd()
@@ -58,38 +62,44 @@ layout = [[sg.Column(frames, element_justification='c'), sg.VSeperator(), sg.Col
 # create the window and show it without the plot
 window = sg.Window('Demo Application - OpenCV Integration', layout, resizable=True)
 
+
+def start_job(name, function, *args):
+    '''pause the preview and run a measurement on a worker thread'''
+    preview.pause()
+    window['-PROGRESS-'].update_bar(0, 100)
+    window['-JOBSTATUS-'].update(' %s: acquiring' % name)
+    return fjobs.MeasurementJob(window, name, function, *args).start()
+
+
 recording = False
 initialize_cam = False
+shown_seq = 0
+imgbytes = None
+job = None   # running MeasurementJob
 
 while True:
-    event, values = window.read(timeout=100)
+    # short timeout: the loop only polls the preview thread, grabbing and encoding happen there
+    event, values = window.read(timeout=20)
     filename = str(cwd + "\\Image_sensor\\CIS_Lab_Python_code_v2\\Save_Image\\" + str(values[1]))
     nbr_frames = int(values[3])
     Xpos = int(values[4])
     Ypos = int(values[5])
     # print (filename)
     if initialize_cam:
-        if camera.IsGrabbing():
-            grabResult = camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-            imraw = grabResult.Array
-            if grabResult.GrabSucceeded():
-                # Access the image data
-                image = converter.Convert(grabResult)
-                img = image.GetArray()
-                width = grabResult.Width
-                height = grabResult.Height  # grabResult.Heigth
-                # recording = True
-            # grabResult.Release()
-        else:
-            grabResult.Release()
-            # recording = False
-    if recording:
-        img_lres = cv2.resize(img, (1280, 960), interpolation=cv2.INTER_AREA)
-        imgbytes = cv2.imencode('.png', img_lres)[1].tobytes()  # ditto
-        window['image'].update(data=imgbytes)
+        # latest frame of the preview thread (already downscaled and encoded as PPM)
+        seq, frame_bytes, frame_img, frame_raw, frame_width, frame_height = preview.latest()
+        if seq != shown_seq:
+            shown_seq = seq
+            imgbytes, img, imraw = frame_bytes, frame_img, frame_raw
+            width, height = frame_width, frame_height
+            if recording:
+                window['image'].update(data=imgbytes)
 
     if event == 'Exit' or event == sg.WIN_CLOSED:
+        if job is not None:
+            job.cancel()
         try:
+            preview.stop()
             fcis.close_camera_and_exit(camera)
         except:
             print("A camera was not connected. Exiting Now.")
@@ -111,22 +121,20 @@ while True:
             converter = fcis.conv_opencv_bw(converter)
             width, height, darkmean, roi_w, roi_h = fcis.camera_frame_set(cameraname)
         window['-SERIAL-'].update(str(device_name))
+        preview = fpreview.PreviewWorker(camera, converter).start()
         initialize_cam = True
 
 
     elif event == 'Start Capture':
         recording = True
-        img_lres = cv2.resize(img, (1280, 960), interpolation=cv2.INTER_AREA)
-        imgbytes = cv2.imencode('.png', img_lres)[1].tobytes()  # ditto
-        window['image'].update(data=imgbytes)
+        if imgbytes is not None:
+            window['image'].update(data=imgbytes)
 
     elif event == 'Stop':
         recording = False
-        # img = np.full((480, 640), 255)
-        # # this is faster, shorter and needs less includes
-        img_lres = cv2.resize(img, (1280, 960), interpolation=cv2.INTER_AREA)
-        imgbytes = cv2.imencode('.png', img_lres)[1].tobytes()
-        window['image'].update(data=imgbytes)
+        # keep the last frame on screen
+        if imgbytes is not None:
+            window['image'].update(data=imgbytes)
 
     elif event == 'Histogram':
         if camera.IsGrabbing():
@@ -134,8 +142,8 @@ while True:
 
     elif event == 'Image data info':
         if camera.IsGrabbing():
-            sg.Popup('SizeX: ', grabResult.Width,
-                     'SizeY: ', grabResult.Height,
+            sg.Popup('SizeX: ', width,
+                     'SizeY: ', height,
                      'RGB  value of 0,0 pixel: ', img[0, 0],
                      'Gray value of 0,0 pixel: ', imraw[0, 0],
                      'RGB  value of 0,1 pixel: ', img[0, 1],
@@ -147,25 +155,63 @@ while True:
 
     elif event == 'Save Image':
         if camera.IsGrabbing():
-            fcis.save_image(imraw, img, filename)
+            fcis.save_image(imraw, img, filename, camera=cameraname)
+
+    elif event == 'Record':
+        if camera.IsGrabbing() and job is None:
+            job = start_job('Record', fcis.record_frames, camera, filename, nbr_frames, cameraname)
 
     elif event == 'Dark':
-        if camera.IsGrabbing():
+        if camera.IsGrabbing() and job is None:
             sg.Popup('Cover the lens and then - Press OK: ')
-            fcis.dark_measurement_and_plot(camera, width, height, nbr_frames)
+            job = start_job('Dark', fcis.acquire_dark, camera, width, height, nbr_frames)
 
     elif event == 'Noise':
-        if camera.IsGrabbing():
-            fcis.measure_noise(camera, width, height, nbr_frames, Xpos, Ypos)
+        if camera.IsGrabbing() and job is None:
+            job = start_job('Noise', fcis.acquire_noise, camera, width, height, nbr_frames)
 
     elif event == 'PTC':
-        if camera.IsGrabbing():
+        if camera.IsGrabbing() and job is None:
             sg.Popup('Cover the lens and then - Press OK: ')
-            darkmean, darknoise, darkmax, darkmeanmean, darkfpn, darknoisemean, darknoisemax = fcis.dark_measurement(camera,
-                                                                                                                width,
-                                                                                                                height,
-                                                                                                             nbr_frames)
+            job = start_job('PTC dark', fcis.acquire_dark, camera, width, height, nbr_frames)
+
+    elif event == 'Cancel':
+        if job is not None:
+            job.cancel()
+
+    elif event == fjobs.JOB_PROGRESS:
+        job_name, frames_done, frames_total = values[event]
+        window['-PROGRESS-'].update_bar(frames_done, frames_total)
+        window['-JOBSTATUS-'].update(' %s: %d / %d frames' % (job_name, frames_done, frames_total))
+
+    elif event == fjobs.JOB_DONE:
+        job_name, result = values[event]
+        job = None
+        preview.resume()
+        window['-JOBSTATUS-'].update(' %s: done' % job_name)
+        # plotting stays on the GUI thread
+        if job_name == 'Dark':
+            fcis.plot_dark_measurement(*result, block=False)
+        elif job_name == 'Noise':
+            fcis.plot_noise(result, Xpos, Ypos, block=False)
+        elif job_name == 'PTC dark':
+            darkmean = result[0]
             sg.Popup('Remove the lens cover and then - Press OK: ')
-            fcis.ptc_measurement_GUI(camera, width, height, nbr_frames, darkmean, darknoise, darkmax, darkmeanmean,
-                                     darkfpn, darknoisemean, darknoisemax)
-
+            job = start_job('PTC', fcis.acquire_ptc, camera, width, height, nbr_frames, darkmean)
+        elif job_name == 'PTC':
+            immean, imvar = result
+            fcis.ptc_analysis_GUI(immean, imvar)
+        elif job_name == 'Record':
+            window['-JOBSTATUS-'].update(' Record: %d frames, %d dropped, %.1f MB/s' % (
+                result['frames_recorded'], result['frames_dropped'], result['average_MBps']))
+
+    elif event in (fjobs.JOB_CANCELLED, fjobs.JOB_ERROR):
+        job_name, error = values[event]
+        job = None
+        preview.resume()
+        window['-PROGRESS-'].update_bar(0, 100)
+        if event == fjobs.JOB_CANCELLED:
+            window['-JOBSTATUS-'].update(' %s: cancelled' % job_name)
+        else:
+            window['-JOBSTATUS-'].update(' %s: failed' % job_name)
+            sg.Popup('Measurement failed: ', str(error))
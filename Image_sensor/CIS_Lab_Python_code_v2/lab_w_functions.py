@@ -57,6 +57,9 @@ while camera.IsGrabbing():
 
         if k == 115: #'s'
             fcis.save_image(imraw, img, "imraw.raw")
+
+        if k == ord('r'):
+            fcis.record_frames(camera, "record", 1000, cameraname)
              
         if k == ord('v'):
             fcis.print_verbose(grabResult, img, imraw)
@@ -0,0 +1,238 @@
+'''
+Lazy filter graph for image post-processing.
+
+Processing1.ipynb chains color_weigh, separate_channels and the skimage filters, and every step
+writes a full size intermediate image: color_weigh alone makes three weighted planes and a
+np.zeros_like image. On a 3840x2160 frame of the daA3840 each of these is 50-200 MB of memory
+traffic. A FilterGraph only records the stages; run() executes them together:
+
+    pointwise stages   weigh (color_weigh), gain, offset, gamma, clip: adjacent ones are fused
+                       into one pass. The image is processed in row blocks that fit in the cache:
+                       a block is read once, every pointwise stage is applied to it in place and it
+                       is written once.
+    filter stages      any neighbourhood filter (median, unsharp_mask, denoise_bilateral, ...),
+                       run like separate_channels, tiled and in parallel when a
+                       tiled_processing.Pipeline is given.
+
+Intermediate images come from a BufferPool and go back to it when the next stage has read them,
+so running the graph on a stream of frames allocates the work buffers only once.
+
+Usage:
+    graph = FilterGraph()
+    graph.weigh([0.35, 0.35, 0.35]).gain(1.2).gamma(1 / 2.2).clip(0, 1)
+    graph.filter(filters.median, halo=2, footprint=disk(2))
+    graph.clip(0, 1).astype(np.uint8, scale=255)
+    img8 = graph.run(img)
+    graph.plan()    # pointwise: weigh, gain, gamma, clip / filter: median / pointwise: clip, astype uint8
+
+'''
+
+import numpy as np
+
+import tiled_processing as ftiled
+
+BLOCK_BYTES = 1 << 20   # size of the row blocks of a fused pass (about the L2 cache)
+
+
+class BufferPool:
+    '''Reusable work buffers, by shape and dtype'''
+
+    def __init__(self):
+        self._free = {}
+        self.allocated = 0      # buffers allocated (not reused) since creation
+
+    def get(self, shape, dtype):
+        '''a buffer of shape and dtype (contents undefined)'''
+        key = (tuple(shape), np.dtype(dtype).str)
+        free = self._free.get(key)
+        if free:
+            return free.pop()
+        self.allocated += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, buf):
+        '''give a buffer obtained with get back to the pool'''
+        self._free.setdefault((buf.shape, buf.dtype.str), []).append(buf)
+
+    def clear(self):
+        '''drop all free buffers'''
+        self._free.clear()
+
+
+class _Pointwise:
+    # one per pixel operation, applied in place to a block of the work dtype
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+
+class FilterGraph:
+    '''Stages declared first and executed together by run()
+
+    dtype    : work dtype of the pointwise passes (float32 halves the traffic of float64)
+    pipeline : tiled_processing.Pipeline running the filter stages, None for one task per channel
+               in this process
+    pool     : BufferPool of the intermediates, shared between graphs if given
+    '''
+
+    def __init__(self, dtype=np.float32, pipeline=None, pool=None):
+        self.dtype = np.dtype(dtype)
+        self.pipeline = pipeline if pipeline is not None else ftiled.Pipeline(tile=None, executor="serial")
+        self.pool = pool if pool is not None else BufferPool()
+        self.stages = []
+        self.out_dtype = None
+        self.out_scale = 1.0
+
+    def _pointwise(self, name, func):
+        if self.out_dtype is not None:
+            raise ValueError("astype must be the last stage")
+        self.stages.append(_Pointwise(name, func))
+        return self
+
+    def weigh(self, w):
+        '''weigh the channels with w / sum(w), as color_weigh'''
+        w = np.asarray(w, dtype=np.float64)
+        w = (w / np.sum(w)).astype(self.dtype)
+        return self._pointwise("weigh", lambda buf: np.multiply(buf, w, out=buf))
+
+    def gain(self, g):
+        '''multiply by g (a number, or one per channel)'''
+        g = np.asarray(g, dtype=self.dtype)
+        return self._pointwise("gain", lambda buf: np.multiply(buf, g, out=buf))
+
+    def offset(self, o):
+        '''add o (a number, or one per channel), e.g. minus the black level'''
+        o = np.asarray(o, dtype=self.dtype)
+        return self._pointwise("offset", lambda buf: np.add(buf, o, out=buf))
+
+    def gamma(self, g, max_value=1.0):
+        '''max_value * (x / max_value) ** g; negative values are set to 0 first'''
+        def apply(buf):
+            np.maximum(buf, 0, out=buf)
+            if max_value != 1.0:
+                buf /= max_value
+            np.power(buf, g, out=buf)
+            if max_value != 1.0:
+                buf *= max_value
+        return self._pointwise("gamma", apply)
+
+    def clip(self, lo, hi):
+        '''limit the values to [lo, hi]'''
+        return self._pointwise("clip", lambda buf: np.clip(buf, lo, hi, out=buf))
+
+    def filter(self, filt, halo=0, separate=True, mult=False, **kwargs):
+        '''neighbourhood filter stage, see tiled_processing.Stage'''
+        if self.out_dtype is not None:
+            raise ValueError("astype must be the last stage")
+        self.stages.append(ftiled.Stage(filt, halo, separate, mult, **kwargs))
+        return self
+
+    def astype(self, dtype, scale=1.0):
+        '''output dtype of the graph, the values are multiplied by scale (e.g. 255 for uint8) and
+        rounded for an integer dtype; the last stage'''
+        self.out_dtype = np.dtype(dtype)
+        self.out_scale = scale
+        return self
+
+    def plan(self):
+        '''the passes run() makes, as text'''
+        passes = []
+        for group in self._groups():
+            if isinstance(group, list):
+                passes.append("pointwise: " + ", ".join(op.name for op in group))
+            else:
+                passes.append("filter: %s" % getattr(group.filt, "__name__", group.filt))
+        if self.out_dtype is not None:
+            # converted in the last pointwise pass, or in a pass of its own after a filter
+            if passes and passes[-1].startswith("pointwise"):
+                passes[-1] += ", astype %s" % self.out_dtype
+            else:
+                passes.append("pointwise: astype %s" % self.out_dtype)
+        return passes
+
+    def _groups(self):
+        # adjacent pointwise stages in one list, filter stages on their own
+        groups = []
+        for stage in self.stages:
+            if isinstance(stage, _Pointwise):
+                if groups and isinstance(groups[-1], list):
+                    groups[-1].append(stage)
+                else:
+                    groups.append([stage])
+            else:
+                groups.append(stage)
+        return groups
+
+    def run(self, image, out=None):
+        '''run the graph on an image; the result is written to out if given'''
+        image = np.asarray(image)
+        groups = self._groups()
+        if self.out_dtype is not None and (not groups or not isinstance(groups[-1], list)):
+            groups.append([])   # the output conversion is a pass of its own after a filter
+        current, pooled = image, False
+        for k, group in enumerate(groups):
+            last = k == len(groups) - 1
+            if isinstance(group, list):
+                if last and out is not None:
+                    dst = out
+                elif last and self.out_dtype is not None:
+                    dst = np.empty(image.shape[:2] + current.shape[2:], dtype=self.out_dtype)
+                elif last:
+                    dst = np.empty(current.shape, dtype=self.dtype)
+                else:
+                    dst = self.pool.get(current.shape, self.dtype)
+                self._fused_pass(group, current, dst, last)
+            else:
+                # a filter on all channels returns a new image (in its own dtype), not a pooled one
+                pool_out = not last and group.separate and current.ndim == 3
+                dst = self.pool.get(current.shape, current.dtype) if pool_out else None
+                dst = self.pipeline.run_stage(group, current, dst)
+                if last and out is not None:
+                    np.copyto(out, dst, casting="unsafe")
+                    dst = out
+            if pooled:
+                self.pool.release(current)
+            current, pooled = dst, not last and (isinstance(group, list) or pool_out)
+        return current
+
+    def _fused_pass(self, ops, src, dst, last):
+        # read each row block once, apply all ops in place, write it once
+        convert = last and self.out_dtype is not None
+        direct = dst.dtype == self.dtype and not convert
+        rows = max(1, BLOCK_BYTES // max(1, src[0].size * self.dtype.itemsize))
+        scratch = None if direct else self.pool.get((rows,) + src.shape[1:], self.dtype)
+        integer = dst.dtype.kind in "iub"
+        for r0 in range(0, src.shape[0], rows):
+            r1 = min(r0 + rows, src.shape[0])
+            buf = dst[r0:r1] if direct else scratch[:r1 - r0]
+            np.copyto(buf, src[r0:r1], casting="unsafe")
+            for op in ops:
+                op.func(buf)
+            if not direct:
+                if convert:
+                    if self.out_scale != 1.0:
+                        buf *= self.out_scale
+                    if integer:
+                        info = np.iinfo(dst.dtype)
+                        np.rint(buf, out=buf)
+                        np.clip(buf, info.min, info.max, out=buf)
+                np.copyto(dst[r0:r1], buf, casting="unsafe")
+        if scratch is not None:
+            self.pool.release(scratch)
+
+
+def color_weigh(imag, w, out=None):
+    '''color_weigh: the notebook function in one pass (result in the image dtype, as np.zeros_like)'''
+    imag = np.asarray(imag)
+    w = np.asarray(w, dtype=np.float64)
+    w = w / np.sum(w)
+    if out is None:
+        out = np.empty_like(imag)
+    rows = max(1, BLOCK_BYTES // max(1, imag[0].size * 8))
+    buf = np.empty((rows,) + imag.shape[1:])
+    for r0 in range(0, imag.shape[0], rows):
+        r1 = min(r0 + rows, imag.shape[0])
+        block = buf[:r1 - r0]
+        np.multiply(imag[r0:r1], w, out=block)
+        np.copyto(out[r0:r1], block, casting="unsafe")
+    return out
@@ -0,0 +1,219 @@
+'''
+Tiled, multi-core image processing for the Processing1 filters.
+
+separate_channels of Processing1.ipynb filters the R, G and B planes one after another on one core,
+so a median / unsharp_mask / denoise_bilateral of a full resolution image takes minutes. Here every
+filter stage is split into tasks, one per channel and tile, that run in a process (or thread) pool:
+
+    tiles   the image is cut into tile x tile blocks; each task filters its block plus a halo of
+            the filter radius on every side (clipped at the image border) and keeps only the block.
+            For a local filter the block then sees exactly the neighbourhood it sees in the whole
+            image, so the stitched result has no seams and is bit-identical to the serial path.
+    halo    the filter radius, see the *_halo helpers (median footprint, gaussian / unsharp_mask
+            radius, bilateral window). halo=None runs one task per channel without tiling, for
+            filters that use statistics of the whole image: denoise_bilateral scales its colour
+            table with image.max() (and uses image.std() without sigma_color), so its tiles would
+            not match the whole image.
+
+With the process pool the input image is placed in shared memory once per stage, the workers only
+receive the name of the shared memory block. The filter and its arguments must be picklable (skimage / scipy
+functions are; a lambda or a function defined in a notebook is not, use executor="thread" then).
+
+Usage:
+    with Pipeline(tile=512) as pipe:
+        pipe.add(unsharp_mask, halo=gaussian_halo(2), separate=False, radius=2, amount=1.5, channel_axis=2)
+        pipe.add(filters.median, halo=footprint_halo(disk(2)), footprint=disk(2))
+        final_img = pipe.run(original_img)
+
+    # one stage, same arguments as the notebook function
+    separate_channels(filters.median, img, footprint=disk(2), halo=2)
+
+'''
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+EXECUTORS = ("process", "thread", "serial")
+
+
+def gaussian_halo(sigma, truncate=4.0):
+    '''gaussian_halo: radius of a gaussian kernel (scipy.ndimage, skimage gaussian / unsharp_mask radius)'''
+    return int(truncate * float(sigma) + 0.5)
+
+
+def footprint_halo(footprint):
+    '''footprint_halo: radius of a footprint (median, rank filters), e.g. footprint_halo(disk(2)) == 2'''
+    return max(np.shape(footprint)) // 2
+
+
+def bilateral_halo(sigma_spatial=1, win_size=None):
+    '''bilateral_halo: radius of the denoise_bilateral window (skimage default window size)'''
+    if win_size is None:
+        win_size = max(5, 2 * int(math.ceil(3 * sigma_spatial)) + 1)
+    return win_size // 2
+
+
+def tile_grid(shape, tile, halo):
+    '''tile_grid: (block, source, block_in_source) slice pairs (rows, columns) of every tile
+
+    block            : the part of the image written by the tile
+    source           : the block plus the halo, clipped at the image border
+    block_in_source  : the block in the coordinates of the source
+    '''
+    height, width = shape[:2]
+    if tile is None or halo is None:
+        whole = (slice(0, height), slice(0, width))
+        return [(whole, whole, whole)]
+    grid = []
+    for y0 in range(0, height, tile):
+        y1 = min(y0 + tile, height)
+        sy0, sy1 = max(y0 - halo, 0), min(y1 + halo, height)
+        for x0 in range(0, width, tile):
+            x1 = min(x0 + tile, width)
+            sx0, sx1 = max(x0 - halo, 0), min(x1 + halo, width)
+            grid.append(((slice(y0, y1), slice(x0, x1)),
+                         (slice(sy0, sy1), slice(sx0, sx1)),
+                         (slice(y0 - sy0, y1 - sy0), slice(x0 - sx0, x1 - sx0))))
+    return grid
+
+
+def _filter_block(source, filt, kwargs, mult, channel, src, core):
+    # one task: filter the source block of a channel (None: all channels) and return the core.
+    # source is the image, or (name, shape, dtype) of the shared memory holding it
+    if isinstance(source, tuple):
+        name, shape, dtype = source
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            # no view of the shared memory is left when this returns, it can be closed
+            return _filter_block(np.ndarray(shape, dtype=dtype, buffer=shm.buf), filt, kwargs, mult,
+                                 channel, src, core)
+        finally:
+            shm.close()
+    block = source[src] if channel is None else source[src + (channel,)]
+    result = filt(block, **kwargs)
+    if mult:
+        result = result[0]
+    return np.array(np.asarray(result)[core], copy=True)
+
+
+class Stage:
+    '''A filter step of a Pipeline
+
+    filt     : filter function, called as filt(block, **kwargs)
+    halo     : filter radius [pixels], None to not tile (whole image statistics)
+    separate : filter the channels one by one (as separate_channels), False to pass all channels
+               (e.g. unsharp_mask with channel_axis=2)
+    mult     : the filter returns a tuple, keep the first element (as separate_channels mult=True)
+    '''
+
+    def __init__(self, filt, halo=0, separate=True, mult=False, **kwargs):
+        self.filt = filt
+        self.halo = halo
+        self.separate = separate
+        self.mult = mult
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return "Stage(%s, halo=%s, separate=%s)" % (getattr(self.filt, "__name__", self.filt), self.halo,
+                                                    self.separate)
+
+
+class Pipeline:
+    '''Filter stages run tile by tile and channel by channel in a pool of workers
+
+    tile     : tile size [pixels], None to only split the channels
+    workers  : pool size, default the number of CPUs
+    executor : "process" (the filters hold the GIL), "thread" or "serial" (same tiles, no pool)
+    '''
+
+    def __init__(self, tile=512, workers=None, executor="process"):
+        if executor not in EXECUTORS:
+            raise ValueError("unknown executor %s, expected one of %s" % (executor, ", ".join(EXECUTORS)))
+        self.tile = tile
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        self.stages = []
+        self._pool = None
+
+    def add(self, filt, halo=0, separate=True, mult=False, **kwargs):
+        '''add a stage (see Stage), returns the pipeline'''
+        self.stages.append(Stage(filt, halo, separate, mult, **kwargs))
+        return self
+
+    def pool(self):
+        '''the worker pool, started on first use'''
+        if self._pool is None and self.executor != "serial":
+            if self.executor == "process":
+                self._pool = ProcessPoolExecutor(self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(self.workers)
+        return self._pool
+
+    def close(self):
+        '''stop the worker pool'''
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, image):
+        '''run all stages on an image, returns the result of the last stage'''
+        for stage in self.stages:
+            image = self.run_stage(stage, image)
+        return image
+
+    def run_stage(self, stage, image, out=None):
+        '''run one stage on an image; out: array for a separate stage (image shape and dtype)'''
+        image = np.asarray(image)
+        channels = range(image.shape[2]) if stage.separate and image.ndim == 3 else [None]
+        grid = tile_grid(image.shape, self.tile, stage.halo)
+        tasks = [(channel, block, src, core) for channel in channels for block, src, core in grid]
+
+        shm = None
+        source = image
+        if self.executor == "process":
+            shm = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+            np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+            source = (shm.name, image.shape, image.dtype.str)
+        try:
+            if self.executor == "serial":
+                results = [_filter_block(source, stage.filt, stage.kwargs, stage.mult, channel, src, core)
+                           for channel, block, src, core in tasks]
+            else:
+                futures = [self.pool().submit(_filter_block, source, stage.filt, stage.kwargs, stage.mult,
+                                              channel, src, core) for channel, block, src, core in tasks]
+                results = [future.result() for future in futures]
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+        if channels[0] is None:
+            # the filter output decides the dtype and the channels
+            first = results[0]
+            out = np.empty(image.shape[:2] + first.shape[2:], dtype=first.dtype)
+        elif out is None:
+            # as separate_channels: np.zeros_like(imag), the planes are cast to the image dtype
+            out = np.empty_like(image)
+        for (channel, block, src, core), result in zip(tasks, results):
+            if channel is None:
+                out[block] = result
+            else:
+                out[block + (channel,)] = result
+        return out
+
+
+def separate_channels(filt, imag, separate=True, mult=False, halo=0, tile=512, workers=None,
+                      executor="process", **kwargs):
+    '''separate_channels: the notebook function, run tiled and in parallel (see Pipeline)'''
+    with Pipeline(tile, workers, executor) as pipe:
+        return pipe.run_stage(Stage(filt, halo, separate, mult, **kwargs), imag)
@@ -1,3 +1,99 @@
+import os
+
+import numpy as np
+
+# The colour matching function tables are in data/cmf next to this file, so the module works from
+# any working directory: the CIE standard observers at 1 nm from 360 to 830 nm, as CVRL csv files
+# of wavelength [nm] and x, y, z bar (the 5 nm grid of ColourSystem is a subsample). After the
+# first parse a table is kept as a binary <file>.cache.npy next to it, used as long as it is newer
+# than the text file.
+MODULE_DIR = os.path.dirname(os.path.abspath(__file__))
+CMF_DIR = os.path.join(MODULE_DIR, "data", "cmf")
+CMF_FILES = {
+    "cie1931_2": "ciexyz31_1.csv",      # CIE 1931 2 degree observer
+    "cie1964_10": "ciexyz64_1.csv",     # CIE 1964 10 degree observer
+}
+CACHE_SUFFIX = ".cache.npy"
+
+_cmf_tables = {}    # observer -> (L, 4) table: wavelength, x, y, z
+_cmf_grids = {}     # (observer, start, stop, step) -> (L, 3) colour matching function
+
+
+def cmf_file(observer="cie1931_2"):
+    """Path of the colour matching function table of an observer.
+
+    Raises FileNotFoundError if the table of the observer is missing.
+
+    """
+
+    if observer not in CMF_FILES:
+        raise KeyError("unknown observer %s, expected one of %s" % (observer, ", ".join(CMF_FILES)))
+    path = os.path.join(CMF_DIR, CMF_FILES[observer])
+    if not os.path.exists(path):
+        raise FileNotFoundError("no colour matching function table for %s, %s is missing" % (observer, path))
+    return path
+
+
+def load_cmf_table(observer="cie1931_2"):
+    """The (L, 4) table of an observer: wavelength [nm] and x, y, z bar.
+
+    Parsed once per session; the binary cache next to the text file
+    makes later sessions skip the text parse.
+
+    """
+
+    if observer in _cmf_tables:
+        return _cmf_tables[observer]
+    path = cmf_file(observer)
+    cache = path + CACHE_SUFFIX
+    table = None
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+        table = np.load(cache, allow_pickle=False)
+    if table is None:
+        with open(path) as f:
+            text = f.read().replace(",", " ")
+        table = np.loadtxt(text.splitlines(), usecols=(0, 1, 2, 3), ndmin=2)
+        try:
+            np.save(cache, table)
+        except OSError:
+            pass    # read-only location: parse again next session
+    _cmf_tables[observer] = table
+    return table
+
+
+def load_cmf(observer="cie1931_2", start=380, stop=780, step=5):
+    """The (L, 3) colour matching function on the grid start:stop:step nm.
+
+    The grid points are taken from the table (a 5 nm grid from a 1 nm
+    table is a subsample, no interpolation); a grid that is not in the
+    table raises ValueError, use a resampling to other grids. The
+    result is cached per grid.
+
+    """
+
+    key = (observer, start, stop, step)
+    if key not in _cmf_grids:
+        table = load_cmf_table(observer)
+        wavelengths = np.arange(start, stop + step / 2, step)
+        index = np.searchsorted(table[:, 0], wavelengths)
+        index = np.minimum(index, len(table) - 1)
+        if not np.allclose(table[index, 0], wavelengths):
+            raise ValueError("%s table (%g-%g nm) does not contain the grid %g-%g nm in %g nm steps"
+                             % (observer, table[0, 0], table[-1, 0], start, stop, step))
+        cmf = table[index, 1:]
+        cmf.flags.writeable = False
+        _cmf_grids[key] = cmf
+    return _cmf_grids[key]
+
+
+class _LazyCMF:
+    """Class attribute loading the colour matching function on first use."""
+
+    def __get__(self, obj, owner):
+        colour_system = owner if obj is None else obj
+        return load_cmf(colour_system.observer, *colour_system.grid)
+
+
 class ColourSystem:
     """A class representing a colour system.
 
@@ -8,18 +104,25 @@ class ColourSystem:
 
     """
 
-    # The CIE colour matching function for 380 - 780 nm in 5 nm intervals
-    cmf = np.loadtxt('cie-cmf.txt', usecols=(1,2,3))
+    # The CIE colour matching function for 380 - 780 nm in 5 nm intervals,
+    # loaded on first use (see load_cmf)
+    observer = "cie1931_2"
+    grid = (380, 780, 5)
+    cmf = _LazyCMF()
 
-    def __init__(self, red, green, blue, white):
+    def __init__(self, red, green, blue, white, observer=None):
         """Initialise the ColourSystem object.
 
         Pass vectors (ie NumPy arrays of shape (3,)) for each of the
         red, green, blue  chromaticities and the white illuminant
-        defining the colour system.
+        defining the colour system. observer selects another colour
+        matching function table (a key of CMF_FILES).
 
         """
 
+        if observer is not None:
+            self.observer = observer
+
         # Chromaticities
         self.red, self.green, self.blue = red, green, blue
         self.white = white
@@ -80,4 +183,92 @@ class ColourSystem:
         """Convert a spectrum to an rgb value."""
 
         xyz = self.spec_to_xyz(spec)
-        return self.xyz_to_rgb(xyz, out_fmt)
\ No newline at end of file
+        return self.xyz_to_rgb(xyz, out_fmt)
+
+    # Batched versions: one row per spectrum / colour, no Python loop over the rows
+
+    def xyz_to_rgb_batch(self, xyz, out_fmt=None):
+        """Transform an (N, 3) array of xyz colours to rgb, like xyz_to_rgb.
+
+        Rows out of the rgb gamut are desaturated and every row that is
+        not all zero is normalized on its maximum, with masked array
+        operations instead of a branch per colour.
+
+        Returns an (N, 3) array of fractional rgb components, or an array
+        of N HTML hex strings if out_fmt='html'; for a single (3,) colour
+        one rgb (3,) or one hex string.
+
+        """
+
+        xyz = np.asarray(xyz, dtype=float)
+        if xyz.ndim == 1:
+            return self.xyz_to_rgb_batch(xyz[np.newaxis], out_fmt)[0]
+        rgb = xyz @ self.T.T
+        # desaturate: add -min to the rows with a negative component
+        rgb += np.maximum(-rgb.min(axis=1), 0)[:, np.newaxis]
+        rgb_max = rgb.max(axis=1)
+        nonzero = np.any(rgb != 0, axis=1)
+        rgb[nonzero] /= rgb_max[nonzero, np.newaxis]
+
+        if out_fmt == 'html':
+            return self.rgb_to_hex_batch(rgb)
+        return rgb
+
+    # '00' ... 'ff' for the hex strings
+    _hex_digits = np.array(['{:02x}'.format(i) for i in range(256)])
+
+    def rgb_to_hex_batch(self, rgb):
+        """Convert an (N, 3) array of fractional rgb values to an array of
+        HTML-style hex strings (one string for a single (3,) rgb value)."""
+
+        rgb = np.asarray(rgb)
+        if rgb.ndim == 1:
+            return self.rgb_to_hex_batch(rgb[np.newaxis])[0]
+        hex_rgb = np.clip((255 * rgb).astype(int), 0, 255)
+        digits = self._hex_digits[hex_rgb]
+        return np.char.add(np.char.add(np.char.add('#', digits[:, 0]), digits[:, 1]), digits[:, 2])
+
+    @property
+    def wavelengths(self):
+        """The wavelengths [nm] of the colour-matching function grid."""
+
+        start, stop, step = self.grid
+        return np.arange(start, stop + step / 2, step)
+
+    def spec_to_xyz_batch(self, spec, wavelengths=None, method='integrate'):
+        """Convert an (N, 81) array of spectra to (N, 3) xyz points.
+
+        The spectra must be on the grid of the colour-matching function,
+        self.cmf: 380-780 nm in 5 nm steps, one spectrum per row. XYZ is
+        one matrix product with the colour-matching function; rows with
+        X + Y + Z = 0 are returned unnormalized (zero), like spec_to_xyz.
+        A single (81,) spectrum gives a single (3,) xyz point.
+
+        Spectra on another grid (e.g. the 1 nm spectrometer data) are
+        resampled when their wavelengths are given, see spectral_resample.
+        The resampling weights and the colour-matching function are
+        combined into one matrix, built once per grid; NaN samples (the
+        "Not Available" rows) are left out.
+
+        """
+
+        spec = np.asarray(spec, dtype=float)
+        batch = np.atleast_2d(spec)
+        if wavelengths is None:
+            XYZ = batch @ self.cmf
+        else:
+            # imported here: scipy is only needed for other grids
+            import spectral_resample as fresample
+            XYZ = fresample.project(batch, wavelengths, self.wavelengths, self.cmf, method)
+        den = XYZ.sum(axis=1)
+        nonzero = den != 0.
+        XYZ[nonzero] /= den[nonzero, np.newaxis]
+        return XYZ[0] if spec.ndim == 1 else XYZ
+
+    def spec_to_rgb_batch(self, spec, out_fmt=None, wavelengths=None):
+        """Convert an (N, 81) array of spectra to (N, 3) rgb values, or N
+        hex strings if out_fmt='html'. See spec_to_xyz_batch for spectra
+        on other wavelength grids."""
+
+        xyz = self.spec_to_xyz_batch(spec, wavelengths)
+        return self.xyz_to_rgb_batch(xyz, out_fmt)
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""Peak, width, centroid and power of batches of spectra.
+
+FWHM and improved_FWHM of module2.ipynb analyse one spectrum per call
+(improved_FWHM fits a UnivariateSpline to every spectrum) and have the
+820 - 840 nm window of the laser diode hardcoded. features() analyses an
+(N, L) batch on one wavelength grid, e.g. a laser diode temperature sweep,
+with whole-array operations:
+
+    peak        maximum of every spectrum in the window and its wavelength
+    fwhm        width at half the peak value: the half maximum crossings are
+                the last sample below it left of the peak and the first one
+                right of the peak, linearly interpolated with the neighbour
+                above it (sub-sample, no spline)
+    centroid    power weighted mean wavelength in the window
+    power       integral of the spectrum over the window (trapezoidal)
+
+    wavelength, counts, names = spectrometer.stack(spectrometer.read_folder("data", "*LD*"))
+    result = features(wavelength, counts, window=(800, 860))
+    result["peak_wavelength"], result["fwhm"]
+
+The spectra should be dark corrected (the Sample column is). NaN samples
+count as zero for the power and the centroid; a NaN next to the peak ends
+the peak region, its crossing is then NaN. Spectra without a positive peak
+in the window, or whose peak region reaches the window edge, get a NaN
+width.
+
+"""
+
+import numpy as np
+
+
+def window_slice(wavelength, window=None):
+    """Index slice of the wavelengths inside window = (min, max) [nm], None for all."""
+
+    if window is None:
+        return slice(0, len(wavelength))
+    lo, hi = window
+    start = np.searchsorted(wavelength, lo, side="left")
+    stop = np.searchsorted(wavelength, hi, side="right")
+    if stop - start < 2:
+        raise ValueError("window %g - %g nm holds less than 2 samples" % (lo, hi))
+    return slice(start, stop)
+
+
+def trapezoid_weights(x):
+    """Weights w with y @ w the trapezoidal integral of y over the grid x."""
+
+    w = np.zeros(len(x))
+    dx = np.diff(x) / 2
+    w[:-1] += dx
+    w[1:] += dx
+    return w
+
+
+def features(wavelength, spectra, window=None):
+    """Peak, FWHM, centroid and power of a batch of spectra, see the module docstring.
+
+    wavelength is the (L,) increasing grid [nm], spectra one spectrum (L,)
+    or a batch (N, L), window = (min, max) [nm] or None for the whole grid.
+
+    Returns a dict of (N,) arrays (scalars for one spectrum): peak_wavelength,
+    peak, half_max, left and right (the half maximum crossings [nm]), fwhm,
+    centroid [nm] and power [counts nm].
+
+    """
+
+    wavelength = np.asarray(wavelength, dtype=float)
+    spectra = np.asarray(spectra, dtype=float)
+    single = spectra.ndim == 1
+    batch = np.atleast_2d(spectra)
+    if batch.shape[1] != len(wavelength):
+        raise ValueError("spectra of %d samples for %d wavelengths" % (batch.shape[1], len(wavelength)))
+    window = window_slice(wavelength, window)
+    x = wavelength[window]
+    y = batch[:, window]
+    n, length = y.shape
+    rows = np.arange(n)
+    index = np.arange(length)
+
+    missing = np.isnan(y)
+    peak_index = np.argmax(np.where(missing, -np.inf, y), axis=1)
+    peak = y[rows, peak_index]
+    half_max = peak / 2
+
+    # last sample below half maximum left of the peak, first one right of it (NaN is below)
+    below = ~(y >= half_max[:, np.newaxis])
+    li = np.max(np.where(below & (index < peak_index[:, np.newaxis]), index, -1), axis=1)
+    ri = np.min(np.where(below & (index > peak_index[:, np.newaxis]), index, length), axis=1)
+    found = (peak > 0) & (li >= 0) & (ri < length)
+    li = np.where(found, li, 0)
+    ri = np.where(found, ri, 1)
+
+    def crossing(i, j):
+        # wavelength where the line through samples i and j reaches half_max
+        yi, yj = y[rows, i], y[rows, j]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return x[i] + (half_max - yi) * (x[j] - x[i]) / (yj - yi)
+
+    left = np.where(found, crossing(li, li + 1), np.nan)
+    right = np.where(found, crossing(ri - 1, ri), np.nan)
+
+    filled = np.where(missing, 0.0, y)
+    w = trapezoid_weights(x)
+    power = filled @ w
+    with np.errstate(invalid="ignore", divide="ignore"):
+        centroid = (filled @ (w * x)) / power
+
+    result = {
+        "peak_wavelength": np.where(np.all(missing, axis=1), np.nan, x[peak_index]),
+        "peak": peak,
+        "half_max": half_max,
+        "left": left,
+        "right": right,
+        "fwhm": right - left,
+        "centroid": centroid,
+        "power": power,
+    }
+    if single:
+        return {key: value[0] for key, value in result.items()}
+    return result
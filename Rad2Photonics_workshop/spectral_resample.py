@@ -0,0 +1,178 @@
+"""Resampling of spectra between wavelength grids.
+
+The spectrometer files in data/ are sampled every 1 nm from 260 to 1100 nm
+with "Not Available" gaps at both ends, while ColourSystem needs spectra on
+the 380 - 780 nm, 5 nm grid of the colour matching function. Resampling from
+one grid to another is linear in the spectrum, so it is a (target x source)
+matrix with a few non-zero weights per row. The matrix is built once per
+(source grid, target grid, method) and cached; resampling a batch of spectra
+is then a sparse matrix product:
+
+    spectra_5nm = resample(counts, wavelengths, np.arange(380, 781, 5))
+
+Methods:
+    linear      linear interpolation at the target wavelengths (upsampling,
+                grids of similar spacing)
+    integrate   weighted average of the source samples under the triangle
+                (hat) function of each target point, trapezoidal in the
+                source spacing (downsampling, e.g. 1 nm to 5 nm: every
+                source sample contributes, narrow lines are not missed)
+
+NaN source values (the "Not Available" rows) are left out: the weights of the
+remaining samples of a target point are renormalized. Target points without
+any valid source sample get the fill value.
+
+"""
+
+import numpy as np
+import scipy.sparse
+
+METHODS = ("linear", "integrate")
+CACHE_SIZE = 32
+
+_weights_cache = {}     # (source bytes, target bytes, method) -> csr matrix
+_projection_cache = {}  # (source bytes, target bytes, method, matrix bytes) -> (used, matrix)
+
+
+def _linear_weights(source, target):
+    # two neighbours per target point inside the source range
+    inside = (target >= source[0]) & (target <= source[-1])
+    t = np.flatnonzero(inside)
+    right = np.clip(np.searchsorted(source, target[t], side="right"), 1, len(source) - 1)
+    left = right - 1
+    frac = (target[t] - source[left]) / (source[right] - source[left])
+    rows = np.concatenate((t, t))
+    cols = np.concatenate((left, right))
+    vals = np.concatenate((1 - frac, frac))
+    return rows, cols, vals
+
+
+def _integrate_weights(source, target):
+    # hat function of every target point (zero at its neighbours), sampled at the
+    # source points and multiplied by the trapezoidal source spacing
+    spacing = np.gradient(source) if len(source) > 1 else np.ones(1)
+    lower = np.concatenate(([target[0] - (target[1] - target[0]) if len(target) > 1 else target[0] - 1],
+                            target[:-1]))
+    upper = np.concatenate((target[1:], [target[-1] + (target[-1] - target[-2]) if len(target) > 1
+                                         else target[0] + 1]))
+    first = np.searchsorted(source, lower, side="right")
+    last = np.searchsorted(source, upper, side="left")
+    counts = last - first
+    rows = np.repeat(np.arange(len(target)), counts)
+    # source indices first .. last - 1 of every target point, concatenated
+    cols = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts - first, counts)
+    x = source[cols]
+    t = target[rows]
+    hat = np.where(x <= t, (x - lower[rows]) / (t - lower[rows]), (upper[rows] - x) / (upper[rows] - t))
+    vals = hat * spacing[cols]
+    keep = vals > 0
+    return rows[keep], cols[keep], vals[keep]
+
+
+def resample_weights(source, target, method="linear"):
+    """The (len(target), len(source)) sparse resampling matrix (cached).
+
+    Each row holds the unnormalized weights of the source samples for one
+    target wavelength; resample normalizes them by the weights of the valid
+    samples.
+
+    """
+
+    if method not in METHODS:
+        raise ValueError("unknown resampling method %s, expected one of %s" % (method, ", ".join(METHODS)))
+    source = np.ascontiguousarray(source, dtype=float)
+    target = np.ascontiguousarray(target, dtype=float)
+    key = (source.tobytes(), target.tobytes(), method)
+    weights = _weights_cache.get(key)
+    if weights is None:
+        if np.any(np.diff(source) <= 0) or np.any(np.diff(target) <= 0):
+            raise ValueError("wavelength grids must be strictly increasing")
+        if method == "linear":
+            rows, cols, vals = _linear_weights(source, target)
+        else:
+            rows, cols, vals = _integrate_weights(source, target)
+        weights = scipy.sparse.csr_matrix((vals, (rows, cols)), shape=(len(target), len(source)))
+        weights.sum_duplicates()
+        weights.eliminate_zeros()
+        if len(_weights_cache) >= CACHE_SIZE:
+            _weights_cache.pop(next(iter(_weights_cache)))
+        _weights_cache[key] = weights
+    return weights
+
+
+def resample(spectra, source, target, method="linear", fill=0.0):
+    """Resample spectra from the source to the target wavelength grid.
+
+    spectra is one spectrum (L,) or a batch (N, L) on the source grid, NaN
+    for missing samples. Returns (len(target),) or (N, len(target)).
+
+    """
+
+    spectra = np.asarray(spectra, dtype=float)
+    single = spectra.ndim == 1
+    batch = np.atleast_2d(spectra)
+    weights = resample_weights(source, target, method)
+    valid = ~np.isnan(batch)
+    if valid[:, support(source, target, method)].all():
+        # every row has the same normalization: one product (the sparse product only reads
+        # the samples with a weight, NaN outside the target range does not matter)
+        norm = np.asarray(weights.sum(axis=1)).ravel()
+        result = (weights @ batch.T).T
+        covered = norm > 0
+        result[:, covered] /= norm[covered]
+        result[:, ~covered] = fill
+    else:
+        norm = (weights @ valid.T.astype(float)).T
+        result = (weights @ np.where(valid, batch, 0.0).T).T
+        covered = norm > 0
+        result[covered] /= norm[covered]
+        result[~covered] = fill
+    return result[0] if single else result
+
+
+def support(source, target, method="linear"):
+    """Boolean mask of the source samples that have a weight for the target grid."""
+
+    return resample_weights(source, target, method).getnnz(axis=0) > 0
+
+
+def projection(source, target, matrix, method="integrate"):
+    """Resampling followed by a matrix, as one matrix (cached).
+
+    Returns (used, P): the mask of the source samples with a weight and the
+    (used.sum(), k) matrix of the normalized resampling weights times matrix
+    (len(target), k). For matrix = the colour matching function on the target
+    grid, the XYZ of a batch of source spectra is spectra[:, used] @ P.
+
+    """
+
+    matrix = np.ascontiguousarray(matrix, dtype=float)
+    key = (np.ascontiguousarray(source, dtype=float).tobytes(),
+           np.ascontiguousarray(target, dtype=float).tobytes(), method, matrix.tobytes(), matrix.shape)
+    if key not in _projection_cache:
+        weights = resample_weights(source, target, method)
+        norm = np.asarray(weights.sum(axis=1)).ravel()
+        scale = np.divide(1.0, norm, out=np.zeros_like(norm), where=norm > 0)
+        used = support(source, target, method)
+        full = np.asarray(weights.T @ (scale[:, np.newaxis] * matrix))
+        if len(_projection_cache) >= CACHE_SIZE:
+            _projection_cache.pop(next(iter(_projection_cache)))
+        _projection_cache[key] = (used, full[used])
+    return _projection_cache[key]
+
+
+def project(spectra, source, target, matrix, method="integrate"):
+    """Resample spectra to the target grid and multiply by matrix.
+
+    The same as resample(spectra, source, target, method) @ matrix (with
+    fill=0), as one product with the cached projection when the spectra have
+    no NaN where the weights are; otherwise through resample.
+
+    """
+
+    spectra = np.asarray(spectra, dtype=float)
+    used, P = projection(source, target, matrix, method)
+    selected = spectra[..., used]
+    if np.isnan(selected).any():
+        return resample(spectra, source, target, method) @ np.asarray(matrix, dtype=float)
+    return selected @ P
@@ -0,0 +1,264 @@
+"""Reader for the spectrometer TXT export files in data/.
+
+The files (e.g. data/15deg_40mA_LD_0901140U1.TXT) are a short header and
+one row per wavelength:
+
+    15deg_LD_40mA
+    Integration time [ms]:  10,000
+    Averaging Nr. [scans]: 30
+    Smoothing Nr. [pixels]: 0
+    Data measured with spectrometer [name]: 0901140U1
+    Wave   ;Sample   ;Dark     ;Reference;Scope
+    [nm]   ;[counts] ;[counts] ;[counts]
+
+     260,00;   Not Available
+     ...
+     343,00;   -3,173;   -0,042; 5308,653
+
+The header becomes Spectrum.metadata. The data rows are decoded all at once
+on the bytes of the file (no per line or per value Python code): the
+separators give the fields, the digits of every field are summed into an
+integer mantissa with cumulative sums, and the digits after the decimal comma
+give its power of ten. Missing fields ("Not Available", the Scope column,
+which is never written) are NaN. Unlike str2float of module2.ipynb the sign
+of the counts is kept.
+
+After the first parse a file is kept as a binary <file>.cache.npz next to it,
+valid as long as the modification time and size of the file are unchanged,
+so reading a whole folder again is a few binary loads:
+
+    spectra = read_folder("data")
+    wavelength, counts, names = stack([s for s in spectra if "LD" in s.name])
+
+"""
+
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+CACHE_SUFFIX = ".cache.npz"
+CACHE_VERSION = 1   # bumped when the parser output changes, older caches are parsed again
+
+# header labels -> metadata keys, other "label: value" lines keep their label
+HEADER_KEYS = {
+    "Integration time [ms]": "integration_time",
+    "Averaging Nr. [scans]": "averaging",
+    "Smoothing Nr. [pixels]": "smoothing",
+    "Data measured with spectrometer [name]": "spectrometer",
+}
+
+_DATA_START = re.compile(rb"^[ \t]*[-+]?\d[\d,.]*[ \t]*;", re.MULTILINE)   # a wavelength and ";"
+_NUMBER_BYTES = np.zeros(256, dtype=bool)
+_NUMBER_BYTES[list(b"0123456789,.-+ \t\r")] = True
+
+_spectra = {}   # (path, mtime_ns, size) -> Spectrum, for repeated reads in one session
+
+
+class Spectrum:
+    """One spectrometer file: header metadata and data columns.
+
+    data holds one column per header column name (Wave, Sample, Dark,
+    Reference, Scope), NaN where a row has no value.
+
+    """
+
+    def __init__(self, path, name, metadata, columns, units, data):
+        self.path = path
+        self.name = name
+        self.metadata = metadata
+        self.columns = columns
+        self.units = units
+        self.data = data
+
+    def __repr__(self):
+        return "Spectrum(%s, %d rows, %s)" % (self.name, len(self.data), ", ".join(self.columns))
+
+    def column(self, name):
+        """The values of a column, by its header name (case insensitive)."""
+
+        names = [c.lower() for c in self.columns]
+        if name.lower() not in names:
+            raise KeyError("no column %s in %s, expected one of %s"
+                           % (name, self.path, ", ".join(self.columns)))
+        return self.data[:, names.index(name.lower())]
+
+    @property
+    def wavelength(self):
+        """The wavelengths [nm], the first column."""
+
+        return self.data[:, 0]
+
+    @property
+    def counts(self):
+        """The sample counts, the second column."""
+
+        return self.data[:, 1]
+
+
+def _number(text):
+    # header value: int, float (comma decimal) or the text itself
+    text = text.strip()
+    for convert in (int, float):
+        try:
+            return convert(text.replace(",", "."))
+        except ValueError:
+            pass
+    return text
+
+
+def parse_header(lines):
+    """Name, metadata, column names and units of the header lines.
+
+    Returns (name, metadata, columns, units). metadata maps the keys of
+    HEADER_KEYS (or the label of an unknown line) to the value, numbers
+    converted.
+
+    """
+
+    name, metadata, columns, units = "", {}, [], []
+    for k, line in enumerate(lines):
+        line = line.strip()
+        if ";" in line:
+            fields = [f.strip() for f in line.split(";")]
+            if not columns:
+                columns = fields
+            elif not units:
+                units = [f.strip("[]") for f in fields]
+        elif ":" in line:
+            label, value = line.split(":", 1)
+            metadata[HEADER_KEYS.get(label.strip(), label.strip())] = _number(value)
+        elif k == 0:
+            name = line
+    return name, metadata, columns, units
+
+
+def parse_rows(data, ncols=None):
+    """Decode the ';' separated rows of a bytes block into an (rows, ncols) array.
+
+    Numbers use a decimal comma (a point is accepted too). A field with
+    anything else than digits, sign, decimal separator and blanks, or
+    without digits, is NaN; rows with fewer fields are padded with NaN
+    and blank lines are dropped. ncols defaults to the widest row.
+
+    """
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    if len(buf) == 0 or buf[-1] != ord("\n"):
+        buf = np.concatenate((buf, np.frombuffer(b"\n", dtype=np.uint8)))
+    newline = buf == ord("\n")
+    sep = newline | (buf == ord(";"))
+    ends = np.flatnonzero(sep)                      # every field ends at a separator
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    row = np.concatenate(([0], np.cumsum(newline[ends])[:-1]))
+    first = np.concatenate(([0], np.flatnonzero(np.diff(row)) + 1))
+    col = np.arange(len(ends)) - first[row]
+
+    def field_sum(values):
+        # sum of values over every field, by differences of the cumulative sum
+        total = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+        return total[ends] - total[starts]
+
+    digit = (buf >= ord("0")) & (buf <= ord("9"))
+    ndigits = field_sum(digit)
+    # weight of every digit: 10 ** (digits after it in its field)
+    field = np.cumsum(sep) - sep                    # field index of every byte
+    after = np.concatenate(([0], np.cumsum(digit)))
+    rank = after[ends[field]] - after[1:]
+    mantissa = field_sum(np.where(digit, (buf - ord("0")).astype(np.int64) * 10 ** np.minimum(rank, 18), 0))
+    # digits after the decimal separator: digits behind the last comma or point of the field
+    decimal = (buf == ord(",")) | (buf == ord("."))
+    position = np.where(decimal, np.arange(len(buf)), -1)
+    last_decimal = np.maximum.reduceat(position, starts)
+    fraction = np.where(last_decimal >= starts, after[ends] - after[np.maximum(last_decimal, 0) + 1], 0)
+    negative = field_sum(buf == ord("-")) > 0
+    valid = (ndigits > 0) & (field_sum(~_NUMBER_BYTES[buf]) == 0) & (ndigits <= 18)
+    values = np.where(valid, mantissa / 10.0 ** fraction, np.nan)
+    values[negative] *= -1
+
+    nrows = row[-1] + 1
+    # blank lines: nothing but blanks in all their fields
+    text = field_sum(~np.isin(buf, (9, 10, 13, 32, ord(";"))))
+    keep = np.bincount(row, weights=text, minlength=nrows) > 0
+    ncols = (col.max() + 1) if ncols is None else ncols
+    table = np.full((nrows, ncols), np.nan)
+    inside = col < ncols
+    table[row[inside], col[inside]] = values[inside]
+    return table[keep]
+
+
+def _parse_file(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    match = _DATA_START.search(raw)
+    split = match.start() if match else len(raw)
+    lines = raw[:split].decode("latin-1").splitlines()
+    name, metadata, columns, units = parse_header(lines)
+    data = parse_rows(raw[split:], len(columns) or None)
+    if not columns:
+        columns = ["column%d" % k for k in range(data.shape[1])]
+    return Spectrum(path, name or os.path.splitext(os.path.basename(path))[0], metadata, columns, units, data)
+
+
+def read_spectrum(path, cache=True):
+    """Read one spectrometer file, see the module docstring.
+
+    With cache the binary <file>.cache.npz is used if it belongs to the
+    current file (same modification time and size), and written otherwise.
+
+    """
+
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if cache and key in _spectra:
+        return _spectra[key]
+    cache_path = path + CACHE_SUFFIX
+    spectrum = None
+    if cache and os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as stored:
+            if (int(stored["version"]) == CACHE_VERSION and int(stored["mtime_ns"]) == stat.st_mtime_ns
+                    and int(stored["size"]) == stat.st_size):
+                header = json.loads(str(stored["header"]))
+                spectrum = Spectrum(path, header["name"], header["metadata"], header["columns"],
+                                    header["units"], stored["data"])
+    if spectrum is None:
+        spectrum = _parse_file(path)
+        if cache:
+            header = {"name": spectrum.name, "metadata": spectrum.metadata, "columns": spectrum.columns,
+                      "units": spectrum.units}
+            try:
+                with open(cache_path, "wb") as f:
+                    np.savez(f, version=CACHE_VERSION, mtime_ns=stat.st_mtime_ns, size=stat.st_size,
+                             header=json.dumps(header), data=spectrum.data)
+            except OSError:
+                pass    # read-only location: parse again next session
+    if cache:
+        _spectra[key] = spectrum
+    return spectrum
+
+
+def read_folder(folder, pattern="*.TXT", cache=True):
+    """Read all spectrometer files of a folder matching pattern, sorted by name."""
+
+    paths = sorted(glob.glob(os.path.join(folder, pattern)))
+    return [read_spectrum(path, cache) for path in paths if not path.endswith(CACHE_SUFFIX)]
+
+
+def stack(spectra, column="Sample"):
+    """The spectra of one column as a batch.
+
+    Returns (wavelength (L,), values (N, L), names). All spectra must
+    have the same wavelength grid.
+
+    """
+
+    if not spectra:
+        raise ValueError("no spectra to stack")
+    wavelength = spectra[0].wavelength
+    for spectrum in spectra[1:]:
+        if not np.array_equal(spectrum.wavelength, wavelength):
+            raise ValueError("%s is not on the wavelength grid of %s" % (spectrum.path, spectra[0].path))
+    values = np.vstack([spectrum.column(column) for spectrum in spectra])
+    return wavelength, values, [spectrum.name for spectrum in spectra]
@@ -0,0 +1,241 @@
+#   X-ray map catalog
+#
+#   Index of the Frame_mean_* / Frame_var_* maps written by Example_file_TC2.py in XRAY_files.
+#   The acquisition conditions are parsed from the file names, all 16x16 maps are stacked in one
+#   array and the whole catalog is cached in a single binary file, so queries like "all 40 kV mean
+#   maps at 10 cm" never read the CSVs again:
+#
+#       catalog = XrayCatalog()
+#       records, maps = catalog.query(kind="mean", kv=40, distance=10)
+#       maps.mean(axis=(1, 2))
+#
+#   The cache is checked against the size and modification time of every map file on each open;
+#   only new or changed files are parsed again.
+
+#  Imports and module declarations
+import os
+import re
+import sys
+
+import numpy as np
+
+# the binary results store is shared with the CIS lab code
+CIS_LAB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Image_sensor",
+                            "CIS_Lab_Python_code_v2")
+if CIS_LAB_PATH not in sys.path:
+    sys.path.append(CIS_LAB_PATH)
+import CIS_results as fres
+
+XRAY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "XRAY_files")
+CACHE_NAME = "XRAY_catalog.npz"
+MAP_SHAPE = (16, 16)
+
+FILE_PATTERN = re.compile(r"^Frame_(mean|var)_(.*)\.(csv|npz)$")
+TAG_PATTERNS = {
+    "distance": re.compile(r"^(\d+(?:\.\d+)?)cm$"),
+    "kv": re.compile(r"^(\d+(?:\.\d+)?)kV$"),
+    "ma": re.compile(r"^(\d+(?:\.\d+)?)mA$"),
+    "x": re.compile(r"^x(-?\d+)$"),
+    "y": re.compile(r"^y(-?\d+)$"),
+    "step": re.compile(r"^step(\d+)$"),
+    "exp_lsb": re.compile(r"^lsb(\d+)$"),
+    "exp_msb": re.compile(r"^msb(\d+)$"),
+}
+DARK_TAGS = ("DARK", "No_RAD")
+
+RECORD_DTYPE = np.dtype([
+    ("path", "U160"),       # relative to the catalog root
+    ("folder", "U40"),      # e.g. XRAY_Dose_new
+    ("kind", "U4"),         # mean or var
+    ("tag", "U80"),         # file name after Frame_<kind>_
+    ("distance", "f8"),     # source distance [cm], nan if not in the name
+    ("kv", "f8"),           # tube voltage [kV]
+    ("ma", "f8"),           # tube current [mA]
+    ("x", "f8"),            # map position
+    ("y", "f8"),
+    ("run", "i4"),          # repeat index (e.g. No_RAD_2), -1 if none
+    ("step", "i4"),         # exposure sweep step (PTC_sweep_step3_lsb32_msb1), -1 if none
+    ("exp_lsb", "f8"),      # exposure registers of a sweep step, nan if none
+    ("exp_msb", "f8"),
+    ("dark", "?"),          # DARK / No_RAD measurement
+    ("label", "U80"),       # the tag words that are not parsed above
+    ("size", "i8"),         # file size and modification time, to validate the cache
+    ("mtime_ns", "i8"),
+])
+
+
+def parse_tag(tag):
+    """ Parse the acquisition conditions from the tag of a map file name
+
+    Args:
+        tag (str): file name after "Frame_mean_" / "Frame_var_", e.g. "10cm_40kV_40mA",
+            "75cm_x-12_y20", "No_RAD_1", "PTC_sweep_step3_lsb32_msb1", "DARK_last_aftermeasur" or ""
+
+    Returns:
+        dict: distance, kv, ma, x, y, exp_lsb, exp_msb (nan if absent), run and step (-1 if
+            absent), dark (bool) and label (the remaining words)
+    """
+    info = {"distance": np.nan, "kv": np.nan, "ma": np.nan, "x": np.nan, "y": np.nan, "run": -1,
+            "step": -1, "exp_lsb": np.nan, "exp_msb": np.nan, "dark": False, "label": ""}
+    for dark_tag in DARK_TAGS:
+        if dark_tag in tag:
+            info["dark"] = True
+            tag = tag.replace(dark_tag, "")
+    rest = []
+    for word in tag.split("_"):
+        if not word:
+            continue
+        for key, pattern in TAG_PATTERNS.items():
+            match = pattern.match(word)
+            if match:
+                info[key] = int(match.group(1)) if key == "step" else float(match.group(1))
+                break
+        else:
+            rest.append(word)
+    # a bare number at the end is the repeat index (No_RAD_1, No_RAD_2, ...)
+    if rest and rest[-1].isdigit():
+        info["run"] = int(rest.pop())
+    info["label"] = "_".join(rest)
+    return info
+
+
+def read_map(path):
+    """ Read one map file, a CSV (np.savetxt) or an .npz results file (CIS_results, dataset "frame")
+
+    Args:
+        path (str): path of the file
+
+    Returns:
+        numpy.ndarray: the map as float64
+    """
+    if path.endswith(".npz"):
+        with fres.load_results(path) as results:
+            return np.asarray(results["frame"], dtype=np.float64)
+    return np.loadtxt(path, delimiter=",", ndmin=2)
+
+
+def scan(root):
+    """ List the map files below root with their size and modification time
+
+    Args:
+        root (str): catalog root folder
+
+    Returns:
+        list: (relative path, kind, tag, size, mtime_ns) for every Frame_mean_* / Frame_var_* file
+    """
+    files = []
+    for folder, _, names in os.walk(root):
+        for name in names:
+            match = FILE_PATTERN.match(name)
+            if not match:
+                continue
+            path = os.path.join(folder, name)
+            stat = os.stat(path)
+            relpath = os.path.relpath(path, root).replace(os.sep, "/")
+            files.append((relpath, match.group(1), match.group(2), stat.st_size, stat.st_mtime_ns))
+    files.sort()
+    return files
+
+
+class XrayCatalog:
+    """ Catalog of the X-ray maps, with the stacked maps cached in one binary file
+
+    Args:
+        root (str): folder with the XRAY_* measurement folders (default: XRAY_files)
+        cache (str): cache file (default: XRAY_catalog.npz in root), None to not cache
+        rebuild (bool): ignore the cache and read every map file again
+
+    Attributes:
+        records (numpy.ndarray): one record per map (RECORD_DTYPE), the fields can be used for
+            vectorized selections, e.g. catalog.records["kv"] == 40
+        maps (numpy.ndarray): (N, 16, 16) float64 maps, in the order of records
+        files_read (int): map files parsed when opening (0 when everything came from the cache)
+    """
+
+    def __init__(self, root=XRAY_PATH, cache="", rebuild=False):
+        self.root = root
+        self.cache = os.path.join(root, CACHE_NAME) if cache == "" else cache
+        files = scan(root)
+        cached = {}
+        if self.cache and not rebuild and os.path.exists(self.cache):
+            with fres.load_results(self.cache) as results:
+                # a cache written with other record fields is rebuilt
+                if results["records"].dtype == RECORD_DTYPE:
+                    for record, image in zip(results["records"], results["maps"]):
+                        cached[record["path"]] = (record, image)
+        records = np.zeros(len(files), dtype=RECORD_DTYPE)
+        maps = np.zeros((len(files),) + MAP_SHAPE)
+        self.files_read = 0
+        for i, (relpath, kind, tag, size, mtime_ns) in enumerate(files):
+            hit = cached.get(relpath)
+            if hit is not None and hit[0]["size"] == size and hit[0]["mtime_ns"] == mtime_ns:
+                records[i], maps[i] = hit
+                continue
+            image = read_map(os.path.join(root, relpath))
+            if image.shape != MAP_SHAPE:
+                raise ValueError("%s: map shape %s, expected %s" % (relpath, image.shape, MAP_SHAPE))
+            maps[i] = image
+            info = parse_tag(tag)
+            records[i] = (relpath, relpath.split("/")[0] if "/" in relpath else "", kind, tag,
+                          info["distance"], info["kv"], info["ma"], info["x"], info["y"], info["run"],
+                          info["step"], info["exp_lsb"], info["exp_msb"], info["dark"], info["label"], size,
+                          mtime_ns)
+            self.files_read += 1
+        self.records = records
+        self.maps = maps
+        if self.cache and (self.files_read or len(cached) != len(files)):
+            fres.save_results(self.cache, records=records, maps=maps, metadata={"root": root})
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, **criteria):
+        """ Indices of the maps matching all criteria
+
+        Args:
+            **criteria: field=value of RECORD_DTYPE, e.g. kind="mean", kv=40, distance=10,
+                folder="XRAY_Dose_new", dark=True. A list or tuple value matches any of its values.
+
+        Returns:
+            numpy.ndarray: indices into records and maps
+        """
+        mask = np.ones(len(self.records), dtype=bool)
+        for field, value in criteria.items():
+            if field not in RECORD_DTYPE.names:
+                raise KeyError("unknown catalog field %s" % field)
+            column = self.records[field]
+            if isinstance(value, (list, tuple, np.ndarray)):
+                mask &= np.isin(column, value)
+            else:
+                mask &= column == value
+        return np.flatnonzero(mask)
+
+    def query(self, **criteria):
+        """ Records and maps matching all criteria (see select)
+
+        Returns:
+            tuple: (records, maps), maps is a (n, 16, 16) array
+        """
+        index = self.select(**criteria)
+        return self.records[index], self.maps[index]
+
+    def pairs(self, **criteria):
+        """ Mean and variance maps of the same measurement
+
+        Args:
+            **criteria: see select (without kind)
+
+        Returns:
+            tuple: (records, mean maps, variance maps) for the measurements that have both
+        """
+        index = self.select(kind="mean", **criteria)
+        var_index = {path: i for i, path in enumerate(self.records["path"])}
+        keep, var = [], []
+        for i in index:
+            j = var_index.get(self.records["path"][i].replace("Frame_mean_", "Frame_var_"))
+            if j is not None:
+                keep.append(i)
+                var.append(j)
+        keep = np.array(keep, dtype=int)
+        var = np.array(var, dtype=int)
+        return self.records[keep], self.maps[keep], self.maps[var]
@@ -0,0 +1,131 @@
+#   X-ray dose response analysis
+#
+#   Per-pixel fits of the TC2 response over the stacked maps of XRAY_catalog. The dark level from
+#   XRAY_Dark is subtracted, then every pixel is fitted with the same linear model in one
+#   least-squares solve (the design matrix is shared, the 256 pixels are the right-hand sides):
+#
+#       S = k(kV) * I / (d + d0)^2 + c
+#
+#   S: dark corrected pixel value, I: tube current [mA], d: source distance [cm], d0: distance
+#   offset of the sensor plane. The response is linear in the current and inverse square in the
+#   distance; k is the per-pixel sensitivity for every tube voltage.
+#
+#       catalog = XrayCatalog()
+#       fit = dose_response(catalog, folder="XRAY_Dose_new")
+#       fit["sensitivity"][fit["kv"].index(40)], fit["residual_rms"]
+
+#  Imports and module declarations
+import numpy as np
+
+import XRAY_catalog as xcat
+
+DARK_FOLDER = "XRAY_Dark"
+
+
+def dark_maps(catalog, records, kind="mean", method="mean", dark_folder=DARK_FOLDER):
+    """ Dark maps matched to the records of a measurement
+
+    Args:
+        catalog (XrayCatalog): the catalog
+        records (numpy.ndarray): catalog records of the measurement maps
+        kind (str): "mean" or "var"
+        method (str): "mean": average of all dark maps; "nearest": the dark map with the closest
+            file modification time (only meaningful on the acquisition PC, a copy or checkout
+            resets the times); "none": no dark subtraction
+        dark_folder (str): folder of the dark maps
+
+    Returns:
+        numpy.ndarray: (n, 16, 16) dark maps, one per record
+    """
+    n = len(records)
+    if method == "none":
+        return np.zeros((n,) + xcat.MAP_SHAPE)
+    dark_records, darks = catalog.query(kind=kind, folder=dark_folder)
+    if len(darks) == 0:
+        raise ValueError("no %s dark maps in %s" % (kind, dark_folder))
+    if method == "mean":
+        return np.broadcast_to(darks.mean(axis=0), (n,) + xcat.MAP_SHAPE)
+    if method == "nearest":
+        dt = np.abs(records["mtime_ns"][:, np.newaxis] - dark_records["mtime_ns"][np.newaxis, :])
+        return darks[np.argmin(dt, axis=1)]
+    raise ValueError("unknown dark matching method %s" % method)
+
+
+def batched_lstsq(design, maps, weights=None):
+    """ Fit every pixel of a map stack with the same linear model in one least-squares solve
+
+    Args:
+        design (numpy.ndarray): (n, p) design matrix, one row per map
+        maps (numpy.ndarray): (n, h, w) stack of maps
+        weights (numpy.ndarray): (n,) weight of every map, None for equal weights
+
+    Returns:
+        tuple: (coefficients (p, h, w), fitted maps (n, h, w), residual maps (n, h, w))
+    """
+    n, p = design.shape
+    shape = maps.shape[1:]
+    y = maps.reshape(n, -1)
+    if weights is None:
+        coef = np.linalg.lstsq(design, y, rcond=None)[0]
+    else:
+        sw = np.sqrt(np.asarray(weights, dtype=np.float64))[:, np.newaxis]
+        coef = np.linalg.lstsq(design * sw, y * sw, rcond=None)[0]
+    fitted = design @ coef
+    return coef.reshape((p,) + shape), fitted.reshape(maps.shape), (y - fitted).reshape(maps.shape)
+
+
+def dose_response(catalog, folder="XRAY_Dose_new", kind="mean", dark="mean", distance_offset=0.0,
+                  per_kv=True, weights=None, **criteria):
+    """ Per-pixel sensitivity to tube current and inverse-square distance
+
+    Args:
+        catalog (XrayCatalog): the catalog
+        folder (str): folder of the dose sweep
+        kind (str): fit the "mean" or the "var" maps
+        dark (str): dark matching method, see dark_maps
+        distance_offset (float): d0 added to the distance in the file name [cm]
+        per_kv (bool): one sensitivity per tube voltage, otherwise one for all
+        weights (numpy.ndarray): weight of every map in the fit, None for equal weights
+        **criteria: further catalog selections, e.g. distance=[5, 10]
+
+    Returns:
+        dict: kv (voltages of the sensitivity maps), sensitivity ((n_kv, 16, 16) [DN cm^2 / mA]),
+            offset (16x16 [DN]), fitted, residuals (n, 16, 16), residual_rms (16x16), r2 (16x16),
+            records, signal (dark corrected maps) and design (the design matrix)
+    """
+    index = catalog.select(kind=kind, folder=folder, dark=False, **criteria)
+    records = catalog.records[index]
+    valid = ~(np.isnan(records["ma"]) | np.isnan(records["distance"]) | np.isnan(records["kv"]))
+    records = records[valid]
+    if len(records) == 0:
+        raise ValueError("no %s maps with distance, kV and mA in %s" % (kind, folder))
+    signal = catalog.maps[index[valid]] - dark_maps(catalog, records, kind, dark)
+
+    exposure = records["ma"] / (records["distance"] + distance_offset) ** 2
+    if per_kv:
+        kv = sorted(set(records["kv"].tolist()))
+        columns = [np.where(records["kv"] == v, exposure, 0.0) for v in kv]
+    else:
+        kv = [np.nan]
+        columns = [exposure]
+    design = np.column_stack(columns + [np.ones(len(records))])
+    if np.linalg.matrix_rank(design) < design.shape[1]:
+        raise ValueError("the selected maps do not determine the fit (too few currents / distances)")
+
+    coef, fitted, residuals = batched_lstsq(design, signal, weights)
+    ss_res = np.sum(residuals ** 2, axis=0)
+    ss_tot = np.sum((signal - signal.mean(axis=0)) ** 2, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r2 = 1.0 - ss_res / ss_tot
+    return {
+        "kv": kv,
+        "sensitivity": coef[:-1],
+        "offset": coef[-1],
+        "fitted": fitted,
+        "residuals": residuals,
+        "residual_rms": np.sqrt(ss_res / len(records)),
+        "r2": r2,
+        "records": records,
+        "signal": signal,
+        "design": design,
+    }
@@ -12,9 +12,12 @@ import matplotlib.pyplot as plt
 import time
 import os
 import keyboard
+import TC2_functions as tc2
 
 # Load TC2 dynamic library for register and data interface
 TC2_fnc = cdll.LoadLibrary("./TC2-CIS_Py.dll")
+# register writes go through a shadow copy: unchanged registers are not sent again
+regs = tc2.RegisterMap(TC2_fnc)
 
 # Name to add to the
 newname = "DARK_last_aftermeasur"
@@ -24,37 +27,30 @@ exp_msb = 1
 # number of frames to capture
 nbr_frames = 20
 save_path = "./XRAY_Map_cross/"
-
-
-def split32bit(num):        # split 64bit in 2 words of 32 bits
-    binary = bin(num)[2:].rjust(32, '0')
-    return int(binary[:16], 2), int(binary[16:], 2)
+# Unattended exposure sweep: (exp_lsb, exp_msb) settings measured one after the other, with the
+# PTC fit updated after every step. Empty list: interactive capture, one map pair per X-ray setting
+sweep_exposures = []
+# sweep_exposures = [(lsb, msb) for msb in range(0, 4) for lsb in range(32, 256, 32)]
+sweep_name = "PTC_sweep"
 
 
 def set_exposure_time (reg3_val, reg4_val):
     # Set the exposure and timing settings
-    sts = TC2_fnc.send_command(3, reg3_val)  # REG 3 - Row time LSB
-    sts = TC2_fnc.send_command(4, reg4_val)  # REG 4 - Row time MSB
+    tc2.set_exposure(regs, reg3_val, reg4_val)
 
 
 def frame_read(rg_begin, rg_end):
-    pix_val = []
-    for i in range(rg_begin, rg_end):
-        a = TC2_fnc.send_command(9, i)
-        a = abs(a)
-        a1, a2 = split32bit(a)
-        if a1 > 60000:
-            a1 = 0
-        if a2 > 60000:
-            a2 = 0
-        pix_val.append(a1)
-        pix_val.append(a2)
-    matrix = np.array(pix_val).reshape(-1, 16)
-    return matrix
-
-
-def save_frame(data2save, savepath, filename_frame):
-    np.savetxt(savepath + filename_frame + '.csv', data2save, delimiter=',')
+    # bulk read of the address range, unpacked with vectorized bit operations (see TC2_functions)
+    return tc2.frame_read(TC2_fnc, rg_begin, rg_end)
+
+
+def save_frame(data2save, savepath, filename_frame, lsb=None, msb=None):
+    # binary results file (CIS_results.load_results reads it back), one dataset per map
+    tc2.fres.save_results(savepath + filename_frame + '.npz', frame=data2save,
+                          metadata={'name': filename_frame,
+                                    'exp_lsb': exp_lsb if lsb is None else int(lsb),
+                                    'exp_msb': exp_msb if msb is None else int(msb),
+                                    'nbr_frames': nbr_frames, 'time': time.time()})
     # save an image
     intdata = (np.rint(data2save)).astype(int)
     im = Image.fromarray(intdata)
@@ -62,104 +58,63 @@ def save_frame(data2save, savepath, filename_frame):
     return 0
 
 
-# Initial settings #
-status = TC2_fnc.send_command(0, 129)   # REG 0 - Load Matrix->A and Digital CDS
-status = TC2_fnc.send_command(5, 0)     # REG 5 - Reset reference value LSB
-status = TC2_fnc.send_command(6, 16)    # REG 5 - Reset reference value MSB
-status = TC2_fnc.send_command(7, 0)     # REG 7 - Signal reference value LSB
-status = TC2_fnc.send_command(8, 16)    # REG 8 - Signal reference value MSB
-status = TC2_fnc.send_command(2, 15)    # REG 2 - Enable all needed supplies
-status = TC2_fnc.send_command(1, 24)    # REG 1 - Full Frame + Cont Run + RST ROW/COL ('0')
-status = TC2_fnc.send_command(10, 19)   # REG 10 - start Val timming + bypass=0
-status = TC2_fnc.send_command(35, 16)   # REG 37 - Row number read
+def save_sweep_step(step, lsb, msb, immean, imvar, results):
+    # maps of every sweep step, named after the step and the exposure registers (XRAY_catalog fields)
+    name = "%s_step%d_lsb%d_msb%d" % (sweep_name, step, lsb, msb)
+    save_frame(immean, save_path, "Frame_mean_" + name, lsb, msb)
+    save_frame(imvar, save_path, "Frame_var_" + name, lsb, msb)
 
 
+# Initial settings #
+regs.apply("initial")
+
 # ------------------------------------------------------------------
 #               Timing control
 # ------------------------------------------------------------------
-##  RST
-sts = TC2_fnc.send_command(11, 20)          # REG 11 - RST Delay LSB
-sts = TC2_fnc.send_command(12, 0)           # REG 12 - RST Delay MID
-sts = TC2_fnc.send_command(13, 0)           # REG 13 - RST Delay MSB
-sts = TC2_fnc.send_command(14, 186)         # REG 14 - RST Enable LSB
-sts = TC2_fnc.send_command(15, exp_lsb-1)   # REG 15 - RST Enable MID
-sts = TC2_fnc.send_command(16, exp_msb)     # REG 16 - RST Enable MSB
-sts = TC2_fnc.send_command(38, 226)         # REG 11 - RST Delay B LSB
-sts = TC2_fnc.send_command(39, exp_lsb-1)   # REG 12 - RST Delay B MID
-sts = TC2_fnc.send_command(40, exp_msb)     # REG 13 - RST Delay B MSB
-##  SEL
-sts = TC2_fnc.send_command(17, 20)     # REG 17 - SEL Delay LSB
-sts = TC2_fnc.send_command(18, 0)      # REG 18 - SEL Delay MID
-sts = TC2_fnc.send_command(19, 0)      # REG 19 - SEL Delay MSB
-sts = TC2_fnc.send_command(20, 156)    # REG 20 - SEL Enable LSB
-sts = TC2_fnc.send_command(21, exp_lsb-1)     # REG 21 - SEL Enable MID
-sts = TC2_fnc.send_command(22, exp_msb)      # REG 22 - SEL Enable MSB
-##  SHS
-sts = TC2_fnc.send_command(23, 161)     # REG 23 - SHS Delay LSB
-sts = TC2_fnc.send_command(24, exp_lsb-1)      # REG 24 - SHS Delay MID
-sts = TC2_fnc.send_command(25, exp_msb)      # REG 25 - SHS Delay MSB
-sts = TC2_fnc.send_command(26, 181)    # REG 26 - SHS Enable LSB
-sts = TC2_fnc.send_command(27, exp_lsb-1)     # REG 27 - SHS Enable MID
-sts = TC2_fnc.send_command(28, exp_msb)      # REG 28 - SHS Enable MSB
-##  SHR
-sts = TC2_fnc.send_command(29, 218)     # REG 29 - SHR Delay LSB
-sts = TC2_fnc.send_command(30, exp_lsb-1)      # REG 30 - SHR Delay MID
-sts = TC2_fnc.send_command(31, exp_msb)       # REG 31 - SHR Delay MSB
-sts = TC2_fnc.send_command(32, 236)    # REG 32 - SHR Enable LSB
-sts = TC2_fnc.send_command(33, exp_lsb-1)     # REG 33 - SHR Enable MID
-sts = TC2_fnc.send_command(34, exp_msb)      # REG 34 - SHR Enable MSB
+tc2.configure_timing(regs, exp_lsb, exp_msb)
 
 time.sleep(1)
 
 # ------------------------------------------------------------------
 #               Frame acquisition
 # ------------------------------------------------------------------
-imgset = np.zeros((16, 16, nbr_frames))
-immean = np.zeros((16, 16))
-imvar = np.zeros((16, 16))
-mean2mean = []
-mean2var = []
-
 isExist = os.path.exists(save_path)
 if not isExist:
     # Create a new directory because it does not exist
     os.makedirs(save_path)
-# set the exposure time
+
+if sweep_exposures:
+    # no operator needed: every step sets the exposure, waits, drops a frame and accumulates the
+    # maps; the sweep results are saved after every step
+    ptc = tc2.ptc_sweep(regs, sweep_exposures, nbr_frames, settle_frames=1, settle_time=1.0,
+                        results_file=save_path + sweep_name + ".npz", on_step=save_sweep_step)
+    print("PTC fit (variance = a * mean + b):", ptc["fit"][-1])
+    print("Conversion gain [e-/DN]:", ptc["conversion_gain"])
+    print("Register writes:", regs.stats())
+else:
+    # set the exposure time
     set_exposure_time(exp_lsb, exp_msb)
     time.sleep(4)
 
-while True:
-    # frame read to be scraped
-    scrap = frame_read(128, 256)
-    for j in range(nbr_frames):
-        print(j)
-        imgset[:, :, j] = frame_read(128, 256)
-    immean[:, :] = np.mean(imgset, axis=2)
-    imvar[:, :] = np.var(imgset, axis=2)
-    print("Mean value of mean image", immean[:, :].mean())
-    print("Mean value of variance", imvar[:, :].mean())
-    mean2mean.append(immean[:, :].mean())
-    mean2var.append(imvar[:, :].mean())
-    print("--------------------------\n")
-    filename_frame = "Frame_mean_" + newname
-    save_frame(immean[:, :], save_path, filename_frame)
-    filename_frame = "Frame_var_" + newname
-    save_frame(imvar[:, :], save_path, filename_frame)
-    time.sleep(1)
-
-    try:
-        print("To Exit type -> quit - or\n")
-        newname = input("Set new Xray settings, type a new name and and Press enter to continue\n")
-    except SyntaxError:
-        pass
-    if newname == "quit":
-        print("Program will terminate")
-        break
-
-    # In case of a creation of a multiple frame capture loop with key press in between we can use:
-
-    #  !!! To be used inside a for loop  !!!
-    # try:
-    #     newname = input("Set new Xray settings, type a name and and Press enter to continue")
-    # except SyntaxError:
-    #     pass
+    reader = tc2.TC2Reader(TC2_fnc, 128, 256)   # preallocated word and frame buffers
+    while True:
+        # frame read to be scraped
+        scrap = reader.read()
+        immean, imvar = tc2.capture_stats(reader, nbr_frames)
+        print("Mean value of mean image", immean.mean())
+        print("Mean value of variance", imvar.mean())
+        print("--------------------------\n")
+        filename_frame = "Frame_mean_" + newname
+        save_frame(immean, save_path, filename_frame)
+        filename_frame = "Frame_var_" + newname
+        save_frame(imvar, save_path, filename_frame)
+        time.sleep(1)
+
+        try:
+            print("To Exit type -> quit - or\n")
+            newname = input("Set new Xray settings, type a new name and and Press enter to continue\n")
+        except SyntaxError:
+            pass
+        if newname == "quit":
+            print("Program will terminate")
+            break
@@ -0,0 +1,433 @@
+#   TC2-CIS helper functions
+#
+#   Frame readout of the TC2 dynamic library (TC2-CIS_Py.dll), the register settings with a cached
+#   register writer, the unattended exposure sweep, the TC2 sensor backend and a local stand-in for
+#   the library, so the readout and the statistics can be run without the TC2 board.
+
+#  Imports and module declarations
+import os
+import sys
+import time
+import numpy as np
+
+# the sensor backend interface and the synthetic sensor are shared with the CIS lab code
+CIS_LAB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Image_sensor",
+                            "CIS_Lab_Python_code_v2")
+if CIS_LAB_PATH not in sys.path:
+    sys.path.append(CIS_LAB_PATH)
+import CIS_backends as fbackends
+import CIS_frame_stats as fstats
+import CIS_ptc as fptc
+import CIS_results as fres
+
+FRAME_READ_CMD = 9      # send_command(9, address) returns the 32 bit word at address (2 pixels)
+PIXEL_CLIP = 60000      # pixel values above this are readout errors and set to 0
+FRAME_COLUMNS = 16
+
+# Initial settings (register, value)
+INITIAL_SETTINGS = [
+    (0, 129),   # REG 0 - Load Matrix->A and Digital CDS
+    (5, 0),     # REG 5 - Reset reference value LSB
+    (6, 16),    # REG 6 - Reset reference value MSB
+    (7, 0),     # REG 7 - Signal reference value LSB
+    (8, 16),    # REG 8 - Signal reference value MSB
+    (2, 15),    # REG 2 - Enable all needed supplies
+    (1, 24),    # REG 1 - Full Frame + Cont Run + RST ROW/COL ('0')
+    (10, 19),   # REG 10 - start Val timming + bypass=0
+    (35, 16),   # REG 35 - Row number read
+]
+
+
+def timing_registers(exp_lsb, exp_msb):
+    """(register, value) pairs of the RST/SEL/SHS/SHR timing control for an exposure setting
+
+    The enable/delay MID and MSB registers follow the row time, so the whole block depends on the
+    exposure.
+
+    Args:
+        exp_lsb (int): row time LSB (REG 3)
+        exp_msb (int): row time MSB (REG 4)
+
+    Returns:
+        list: (register, value) in the write order of the original script
+    """
+    return [
+        #  RST
+        (11, 20),           # REG 11 - RST Delay LSB
+        (12, 0),            # REG 12 - RST Delay MID
+        (13, 0),            # REG 13 - RST Delay MSB
+        (14, 186),          # REG 14 - RST Enable LSB
+        (15, exp_lsb - 1),  # REG 15 - RST Enable MID
+        (16, exp_msb),      # REG 16 - RST Enable MSB
+        (38, 226),          # REG 38 - RST Delay B LSB
+        (39, exp_lsb - 1),  # REG 39 - RST Delay B MID
+        (40, exp_msb),      # REG 40 - RST Delay B MSB
+        #  SEL
+        (17, 20),           # REG 17 - SEL Delay LSB
+        (18, 0),            # REG 18 - SEL Delay MID
+        (19, 0),            # REG 19 - SEL Delay MSB
+        (20, 156),          # REG 20 - SEL Enable LSB
+        (21, exp_lsb - 1),  # REG 21 - SEL Enable MID
+        (22, exp_msb),      # REG 22 - SEL Enable MSB
+        #  SHS
+        (23, 161),          # REG 23 - SHS Delay LSB
+        (24, exp_lsb - 1),  # REG 24 - SHS Delay MID
+        (25, exp_msb),      # REG 25 - SHS Delay MSB
+        (26, 181),          # REG 26 - SHS Enable LSB
+        (27, exp_lsb - 1),  # REG 27 - SHS Enable MID
+        (28, exp_msb),      # REG 28 - SHS Enable MSB
+        #  SHR
+        (29, 218),          # REG 29 - SHR Delay LSB
+        (30, exp_lsb - 1),  # REG 30 - SHR Delay MID
+        (31, exp_msb),      # REG 31 - SHR Delay MSB
+        (32, 236),          # REG 32 - SHR Enable LSB
+        (33, exp_lsb - 1),  # REG 33 - SHR Enable MID
+        (34, exp_msb),      # REG 34 - SHR Enable MSB
+    ]
+
+
+def initialize(lib):
+    """Write the initial settings (INITIAL_SETTINGS)"""
+    for reg, val in INITIAL_SETTINGS:
+        lib.send_command(reg, val)
+
+
+def configure_timing(lib, exp_lsb, exp_msb):
+    """Write the timing control registers for an exposure setting (see timing_registers)"""
+    for reg, val in timing_registers(exp_lsb, exp_msb):
+        lib.send_command(reg, val)
+
+
+def exposure_registers(exp_lsb, exp_msb):
+    """(register, value) pairs of an exposure setting: the timing control and the row time"""
+    return timing_registers(exp_lsb, exp_msb) + [
+        (3, exp_lsb),       # REG 3 - Row time LSB
+        (4, exp_msb),       # REG 4 - Row time MSB
+    ]
+
+
+def set_exposure(lib, exp_lsb, exp_msb):
+    """Set the exposure: the timing control and the row time (REG 3 / REG 4)"""
+    for reg, val in exposure_registers(exp_lsb, exp_msb):
+        lib.send_command(reg, val)
+
+
+class RegisterMap:
+    """Register writer with a shadow copy of the values written to the TC2
+
+    Use it in place of the library: send_command(reg, val) only reaches the board when val differs
+    from the last value written to reg, frame read commands always go through. Writing a whole
+    timing block for a new exposure then only sends the registers that follow the row time.
+
+        regs = RegisterMap(TC2_fnc)
+        initialize(regs)
+        set_exposure(regs, 135, 1)     # every register the first time
+        set_exposure(regs, 200, 1)     # only the MID registers and REG 3
+
+    Named profiles are lists of (register, value) applied as one batch.
+
+    Args:
+        lib: loaded TC2 library or a TC2Emulator
+        profiles (dict): name -> list of (register, value), added to the built-in "initial" profile
+
+    Attributes:
+        shadow (dict): register -> last value written
+        writes (int): register writes sent to the board
+        skipped (int): register writes skipped because the value was already set
+    """
+
+    def __init__(self, lib, profiles=None):
+        self.lib = lib
+        self.shadow = {}
+        self.writes = 0
+        self.skipped = 0
+        self.profiles = {"initial": list(INITIAL_SETTINGS)}
+        if profiles:
+            self.profiles.update(profiles)
+
+    def send_command(self, reg, val, force=False):
+        """Write val to reg if it changed (always with force), frame reads go straight to the library
+
+        Returns:
+            the library status of the write, 0 for a skipped write
+        """
+        if reg == FRAME_READ_CMD:
+            return self.lib.send_command(reg, val)
+        if not force and self.shadow.get(reg) == val:
+            self.skipped += 1
+            return 0
+        status = self.lib.send_command(reg, val)
+        self.shadow[reg] = val
+        self.writes += 1
+        return status
+
+    def write(self, pairs, force=False):
+        """Write a batch of (register, value), returns the number of registers sent to the board"""
+        writes = self.writes
+        for reg, val in pairs:
+            self.send_command(reg, val, force)
+        return self.writes - writes
+
+    def add_profile(self, name, pairs):
+        """Store a named list of (register, value)"""
+        self.profiles[name] = list(pairs)
+
+    def add_exposure_profile(self, name, exp_lsb, exp_msb):
+        """Store the timing control and row time of an exposure setting as a named profile"""
+        self.add_profile(name, exposure_registers(exp_lsb, exp_msb))
+
+    def apply(self, name, force=False):
+        """Write a named profile, returns the number of registers sent to the board"""
+        return self.write(self.profiles[name], force)
+
+    def invalidate(self):
+        """Forget the shadow copy (e.g. after a power cycle of the board): the next writes all go through"""
+        self.shadow.clear()
+
+    def stats(self):
+        """Write counts (dict: writes, skipped, registers)"""
+        return {"writes": self.writes, "skipped": self.skipped, "registers": len(self.shadow)}
+
+
+class TC2Reader:
+    """Bulk frame readout from the TC2 library.
+
+    The address range rg_begin..rg_end-1 is read into a preallocated uint32 word buffer and unpacked
+    with NumPy bit operations: the high 16 bits of a word are the first pixel, the low 16 bits the
+    second one, and pixels above PIXEL_CLIP are set to 0. Same result as reading every word with
+    split32bit, without the per-word string conversion and Python lists.
+
+    Args:
+        lib: loaded TC2 library (cdll.LoadLibrary("./TC2-CIS_Py.dll")) or a TC2Emulator
+        rg_begin (int): first word address of the frame
+        rg_end (int): last word address of the frame + 1
+    """
+
+    def __init__(self, lib, rg_begin=128, rg_end=256):
+        if isinstance(lib, RegisterMap):
+            lib = lib.lib   # frame reads need no shadow lookup
+        self.send_command = lib.send_command
+        self.addresses = range(rg_begin, rg_end)
+        self.words = np.empty(len(self.addresses), dtype=np.uint32)
+        self._raw = np.empty(len(self.addresses), dtype=np.int64)     # signed library return values
+        self.pixels = np.empty(2 * len(self.addresses), dtype=np.uint16)
+        self.frame = self.pixels.reshape(-1, FRAME_COLUMNS)
+
+    def read_words(self):
+        """Read the address range into self.words (abs of the signed value returned by the library)"""
+        send_command = self.send_command
+        raw = self._raw
+        for k, address in enumerate(self.addresses):
+            raw[k] = send_command(FRAME_READ_CMD, address)
+        np.abs(raw, out=raw)
+        self.words[:] = raw
+        return self.words
+
+    def unpack(self, words):
+        """Unpack 32 bit words to a (rows, 16) uint16 frame, clipping values above PIXEL_CLIP to 0"""
+        pairs = self.pixels.reshape(-1, 2)
+        np.right_shift(words, 16, out=pairs[:, 0], casting='unsafe')
+        np.bitwise_and(words, 0xFFFF, out=pairs[:, 1], casting='unsafe')
+        self.pixels[self.pixels > PIXEL_CLIP] = 0
+        return self.frame
+
+    def read(self):
+        """Read one frame. The returned array is reused by the next read, copy it to keep it."""
+        return self.unpack(self.read_words())
+
+
+def frame_read(lib, rg_begin, rg_end):
+    """Read one frame from the address range as a new (rows, 16) uint16 array"""
+    return TC2Reader(lib, rg_begin, rg_end).read().copy()
+
+
+def capture_stats(reader, nbr_frames, stats=None):
+    """Per-pixel mean and variance of nbr_frames frames, accumulated frame by frame
+
+    Args:
+        reader (TC2Reader): frame reader
+        nbr_frames (int): number of frames
+        stats (FrameAccumulator): accumulator to reuse (reset first), None for a new one
+
+    Returns:
+        tuple: (mean, variance) maps
+    """
+    if stats is None:
+        stats = fstats.FrameAccumulator(*reader.frame.shape)
+    stats.reset()
+    for _ in range(nbr_frames):
+        stats.add(reader.read())
+    return stats.mean, stats.var()
+
+
+def ptc_sweep(lib, exposures, nbr_frames=20, settle_frames=1, settle_time=1.0, dark=None, fit_max=None,
+              results_file=None, on_step=None, rg_begin=128, rg_end=256):
+    """Unattended PTC sweep over exposure settings
+
+    For every (exp_lsb, exp_msb) setting: set the exposure, wait settle_time, drop settle_frames
+    frames, then accumulate the per-pixel mean and variance of nbr_frames frames. The per-pixel
+    (mean, variance) points of every step are added to the running PTC sums and the fit is updated
+    after each step. With results_file, the results so far are saved after every step, so an
+    interrupted overnight run keeps the finished steps.
+
+    Args:
+        lib: loaded TC2 library, a TC2Emulator or a RegisterMap (a library is wrapped in a new
+            RegisterMap, so every step only writes the registers that change)
+        exposures (list): (exp_lsb, exp_msb) settings, in the order to run them
+        nbr_frames (int): frames per step
+        settle_frames (int): frames dropped after the exposure change
+        settle_time (float): wait after the exposure change [s]
+        dark (tuple): (mean, variance) dark maps; the dark mean is subtracted from the signal and
+            the dark variance gives the read noise of the final analysis
+        fit_max (float): pixels with a mean above fit_max [DN] are left out of the PTC fit (e.g.
+            below saturation), None to fit all
+        results_file (str): .npz results file (CIS_results) updated after every step
+        on_step (callable): called as on_step(step, exp_lsb, exp_msb, immean, imvar, results) after
+            every step, e.g. to save the maps
+        rg_begin (int): first word address of the frame
+        rg_end (int): last word address of the frame + 1
+
+    Returns:
+        dict: exposures, exposure (row time in register counts, msb * 256 + lsb), mean2mean and
+            mean2var (map averages per step), fit ([a, b] of variance = a * mean + b after each
+            step, nan until two exposures are measured), conversion_gain (1 / a of the last fit
+            [e-/DN]), register_writes (registers sent to the board per step) and, with a dark and
+            at least 2 steps, analysis (CIS_ptc.ptc_sweep_analysis)
+    """
+    exposures = np.asarray(exposures, dtype=int).reshape(-1, 2)
+    nsteps = len(exposures)
+    regs = lib if isinstance(lib, RegisterMap) else RegisterMap(lib)
+    reader = TC2Reader(lib, rg_begin, rg_end)
+    stats = fstats.FrameAccumulator(*reader.frame.shape)
+    sums = fptc.PTCSums()
+    results = {
+        "exposures": exposures,
+        "exposure": exposures[:, 1] * 256 + exposures[:, 0],
+        "mean2mean": np.full(nsteps, np.nan),
+        "mean2var": np.full(nsteps, np.nan),
+        "fit": np.full((nsteps, 2), np.nan),
+        "register_writes": np.zeros(nsteps, dtype=int),
+        "conversion_gain": np.nan,
+        "steps_done": 0,
+    }
+    for k, (exp_lsb, exp_msb) in enumerate(exposures):
+        results["register_writes"][k] = regs.write(exposure_registers(int(exp_lsb), int(exp_msb)))
+        time.sleep(settle_time)
+        for _ in range(settle_frames):
+            reader.read()
+        immean, imvar = capture_stats(reader, nbr_frames, stats)
+        if dark is not None:
+            immean = immean - dark[0]
+        results["mean2mean"][k] = immean.mean()
+        results["mean2var"][k] = imvar.mean()
+        if fit_max is None:
+            sums.add(immean, imvar)
+        else:
+            sums.add(immean, imvar, immean <= fit_max)
+        if k > 0:
+            try:
+                results["fit"][k] = sums.linear_fit()
+                results["conversion_gain"] = 1.0 / results["fit"][k][0]
+            except ValueError:
+                pass    # no pixel below fit_max yet
+        results["steps_done"] = k + 1
+        print("step %d/%d exposure (%d, %d), %d register writes: mean %f DN, variance %f DN2, "
+              "conversion gain %f e-/DN" % (k + 1, nsteps, exp_lsb, exp_msb, results["register_writes"][k],
+                                            results["mean2mean"][k], results["mean2var"][k],
+                                            results["conversion_gain"]))
+        if on_step is not None:
+            on_step(k, exp_lsb, exp_msb, immean, imvar, results)
+        if results_file is not None:
+            fres.save_results(results_file, exposures=exposures[:k + 1], exposure=results["exposure"][:k + 1],
+                              mean2mean=results["mean2mean"][:k + 1], mean2var=results["mean2var"][:k + 1],
+                              fit=results["fit"][:k + 1], register_writes=results["register_writes"][:k + 1],
+                              metadata={"nbr_frames": nbr_frames, "steps": nsteps, "steps_done": k + 1})
+
+    if dark is not None and nsteps >= 2:
+        results["analysis"] = fptc.ptc_sweep_analysis(results["exposure"], results["mean2mean"],
+                                                      results["mean2var"], np.mean(dark[1]))
+    return results
+
+
+class TC2Backend(fbackends.SensorBackend):
+    """TC2 board as a SensorBackend (CIS_backends), e.g. for the AcquisitionEngine.
+
+    Args:
+        lib: loaded TC2 library, a TC2Emulator or a RegisterMap (exposure changes only write the
+            registers that differ)
+        rg_begin (int): first word address of the frame
+        rg_end (int): last word address of the frame + 1
+    """
+
+    name = "TC2"
+
+    def __init__(self, lib, rg_begin=128, rg_end=256):
+        self.lib = lib if isinstance(lib, RegisterMap) else RegisterMap(lib)
+        self.reader = TC2Reader(lib, rg_begin, rg_end)
+        self.height, self.width = self.reader.frame.shape
+        self.dtype = self.reader.frame.dtype
+
+    def set_exposure_time(self, exposure_time):
+        """exposure_time is the (exp_lsb, exp_msb) register pair, see set_exposure"""
+        exp_lsb, exp_msb = exposure_time
+        set_exposure(self.lib, exp_lsb, exp_msb)
+
+    def grab(self, out=None, timeout=5000):
+        frame = self.reader.read()
+        if out is None or out.shape != frame.shape or out.dtype != frame.dtype:
+            return frame.copy()
+        np.copyto(out, frame)
+        return out
+
+
+class TC2Emulator:
+    """Local stand-in for the TC2 library (TC2-CIS_Py.dll).
+
+    send_command(reg, val) stores register writes and answers FRAME_READ_CMD with words packed like
+    the sensor does: two 16 bit pixels per word, returned as a signed 32 bit int like the ctypes
+    default restype. A new frame is generated every time the first address of the frame is read,
+    from sensor if given (e.g. a CIS_backends.SyntheticSensor(16, 16) for shot/read noise, PRNU and
+    DSNU), otherwise as gaussian noise around mean.
+
+    Args:
+        rg_begin (int): first word address of the frame
+        rg_end (int): last word address of the frame + 1
+        mean (float): mean pixel value [DN]
+        noise (float): temporal noise [DN rms]
+        seed (int): random generator seed
+        sensor: SensorBackend generating the frames, (rg_end - rg_begin) * 2 / 16 rows of 16 pixels
+    """
+
+    def __init__(self, rg_begin=128, rg_end=256, mean=100.0, noise=5.0, seed=None, sensor=None):
+        self.rg_begin = rg_begin
+        self.rg_end = rg_end
+        self.mean = mean
+        self.noise = noise
+        self.sensor = sensor
+        self.registers = {}
+        self.commands = 0
+        self.rng = np.random.default_rng(seed)
+        self.words = np.zeros(rg_end - rg_begin, dtype=np.int64)
+
+    def new_frame(self):
+        """Generate the next frame and pack it in words"""
+        npix = 2 * (self.rg_end - self.rg_begin)
+        if self.sensor is not None:
+            pixels = self.sensor.grab().astype(np.int64).reshape(-1, 2)
+        else:
+            pixels = np.rint(self.rng.normal(self.mean, self.noise, npix)).clip(0, 65535).astype(np.int64)
+            pixels = pixels.reshape(-1, 2)
+        words = (pixels[:, 0] << 16) | pixels[:, 1]
+        self.words = np.where(words >= 2 ** 31, words - 2 ** 32, words)   # as a signed c_int
+        return pixels.reshape(-1, FRAME_COLUMNS)
+
+    def send_command(self, reg, val):
+        self.commands += 1
+        if reg == FRAME_READ_CMD:
+            if val == self.rg_begin:
+                self.new_frame()
+            if self.rg_begin <= val < self.rg_end:
+                return int(self.words[val - self.rg_begin])
+            return 0
+        self.registers[reg] = val
+        return 0
@@ -0,0 +1,371 @@
+'''
+Benchmark suite for the acquisition and processing paths.
+
+Runs the hot paths on synthetic data, so revisions can be compared without the lab bench:
+    dark         CIS_lab_functions.acquire_dark    (dark_measurement without the prompt)
+    noise        CIS_lab_functions.acquire_noise   (measure_noise without the plot)
+    ptc          CIS_lab_functions.acquire_ptc + the fits of ptc_analysis_GUI (ptc_measurement_GUI)
+    tc2_read     TC2 frame readout (frame_read and TC2Reader) on the TC2Emulator
+    bayer        bilinear_interpolation of Image_processing/Color_reconstruct.ipynb
+    demosaic     Image_processing/demosaic.py, bilinear and edge, float32 into the engine buffer
+    spec_to_rgb  ColourSystem.spec_to_rgb of Rad2Photonics_workshop/module2_tools.py, per spectrum and
+                 spec_to_rgb_batch for all spectra at once
+
+The camera cases grab from a CIS_backends.SyntheticSensor at 1278x960 (puA1280), 1920x1200
+(daA1920) and 3840x2160 (daA3840) with several frame counts. Every case runs in its own process, so
+the reported peak RSS belongs to that case only. Results are written as JSON:
+    frames_per_s   frames (or spectra) processed per second over the whole case
+    peak_rss_mb    peak resident memory of the case process; rss_start_mb is the level before the case
+    stages         per-stage latency: total_s, and per_frame_ms / p95_frame_ms where timed per frame.
+                   The synthetic sensor's frame generation is its own "grab" stage, so the cost of
+                   the measurement itself is acquire_* minus grab.
+A case that cannot run here (e.g. matplotlib missing for CIS_lab_functions) is reported with
+status "error" and the reason, the other cases still run.
+
+Usage:
+    python benchmarks/run_benchmarks.py                        # all cases, JSON on stdout
+    python benchmarks/run_benchmarks.py -o before.json
+    python benchmarks/run_benchmarks.py --cases dark ptc --sizes 1278x960 --frames 16
+    python benchmarks/run_benchmarks.py -o after.json --compare before.json
+
+'''
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CIS_LAB_PATH = os.path.join(ROOT, "Image_sensor", "CIS_Lab_Python_code_v2")
+TC2_PATH = os.path.join(ROOT, "Radiation_project", "XRAY_files")
+IMAGE_PROCESSING_PATH = os.path.join(ROOT, "Image_sensor", "Image_processing")
+RAD2PHOTONICS_PATH = os.path.join(ROOT, "Rad2Photonics_workshop")
+for path in (CIS_LAB_PATH, TC2_PATH, IMAGE_PROCESSING_PATH):
+    if path not in sys.path:
+        sys.path.append(path)
+
+import CIS_backends as fbackends
+
+SIZES = ["1278x960", "1920x1200", "3840x2160"]
+FRAMES = [16, 64]
+CASES = ["dark", "noise", "ptc", "tc2_read", "bayer", "demosaic", "spec_to_rgb"]
+TC2_FRAMES = 200        # the TC2 frame is 16x16, the frame count is fixed
+NSPECTRA = 2000         # spectra converted by the spec_to_rgb case
+
+
+def peak_rss_mb():
+    '''peak resident memory of this process [MB], None if it cannot be read on this platform'''
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        return psutil.Process().memory_info().peak_wset / 2 ** 20   # windows
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return rss / 2 ** 20    # bytes
+    return rss / 2 ** 10        # kilobytes
+
+
+class StageTimer:
+    '''per-stage latency: stage(name) times a block, lap(name) is called once per frame'''
+
+    def __init__(self):
+        self.totals = {}
+        self.laps = {}
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def lap(self, name, seconds):
+        self.add(name, seconds)
+        self.laps.setdefault(name, []).append(seconds)
+
+    def report(self):
+        stages = {}
+        for name, total in self.totals.items():
+            stages[name] = {"total_s": total}
+            if name in self.laps:
+                laps = np.array(self.laps[name]) * 1e3
+                stages[name]["per_frame_ms"] = float(np.median(laps))
+                stages[name]["p95_frame_ms"] = float(np.percentile(laps, 95))
+        return stages
+
+
+class _Stage:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class TimedSensor(fbackends.SensorBackend):
+    '''SensorBackend wrapper that records the grab latency of every frame'''
+
+    def __init__(self, sensor, timer, name="grab"):
+        self.sensor = sensor
+        self.timer = timer
+        self.name = name
+
+    def set_exposure_time(self, exposure_time):
+        self.sensor.set_exposure_time(exposure_time)
+
+    def grab(self, out=None, timeout=5000):
+        start = time.perf_counter()
+        frame = self.sensor.grab(out, timeout)
+        self.timer.lap(self.name, time.perf_counter() - start)
+        return frame
+
+
+def synthetic_sensor(width, height, seed=0):
+    return fbackends.SyntheticSensor(width, height, bit_depth=12, seed=seed)
+
+
+def bench_dark(width, height, nframes, timer):
+    import CIS_lab_functions as fcis
+    sensor = TimedSensor(synthetic_sensor(width, height), timer)
+    with timer.stage("acquire_dark"):
+        fcis.acquire_dark(sensor, width, height, nframes)
+    return nframes
+
+
+def bench_noise(width, height, nframes, timer):
+    import CIS_lab_functions as fcis
+    sensor = TimedSensor(synthetic_sensor(width, height), timer)
+    with timer.stage("acquire_noise"):
+        fcis.acquire_noise(sensor, width, height, nframes)
+    return nframes
+
+
+def bench_ptc(width, height, nframes, timer):
+    import CIS_lab_functions as fcis
+    import CIS_ptc as fptc
+    sensor = synthetic_sensor(width, height)
+    sensor.set_illumination(0.0)
+    darkmean = fcis.acquire_dark(sensor, width, height, nframes)[0]
+    sensor.set_illumination(0.5)
+    timed = TimedSensor(sensor, timer)
+    with timer.stage("acquire_ptc"):
+        immean, imvar = fcis.acquire_ptc(timed, width, height, nframes, darkmean)
+    # the analysis part of ptc_analysis_GUI, without the plots
+    with timer.stage("binned_ptc"):
+        ptcx, ptcy, ptccount = fptc.binned_ptc(immean, imvar)
+    with timer.stage("ptc_fit_binned"):
+        fptc.ptc_fit(ptcx, ptcy, weights=ptccount)
+    with timer.stage("ptc_fit_pixels"):
+        fptc.ptc_fit(immean, imvar)
+    return nframes
+
+
+def bench_tc2_read(width, height, nframes, timer):
+    import TC2_functions as tc2
+    lib = tc2.TC2Emulator(128, 256, seed=0)
+    for _ in range(nframes):
+        start = time.perf_counter()
+        tc2.frame_read(lib, 128, 256)
+        timer.lap("frame_read", time.perf_counter() - start)
+    reader = tc2.TC2Reader(lib, 128, 256)
+    for _ in range(nframes):
+        start = time.perf_counter()
+        reader.read()
+        timer.lap("TC2Reader.read", time.perf_counter() - start)
+    return 2 * nframes
+
+
+def notebook_function(notebook, name, namespace):
+    '''define function name from the code cell of notebook that contains "def name(" in namespace'''
+    with open(notebook, encoding="utf-8") as f:
+        cells = json.load(f)["cells"]
+    for cell in cells:
+        source = "".join(cell["source"])
+        if cell["cell_type"] == "code" and ("def %s(" % name) in source:
+            exec(compile(source, "%s:%s" % (os.path.basename(notebook), name), "exec"), namespace)
+            return namespace[name]
+    raise LookupError("%s not defined in %s" % (name, notebook))
+
+
+def bench_bayer(width, height, nframes, timer):
+    # the notebook function loops over every pixel in Python: one frame per size
+    bilinear_interpolation = notebook_function(os.path.join(IMAGE_PROCESSING_PATH, "Color_reconstruct.ipynb"),
+                                               "bilinear_interpolation", {"np": np})
+    raw = synthetic_sensor(width, height).grab()
+    start = time.perf_counter()
+    bilinear_interpolation(raw)
+    timer.lap("bilinear_interpolation", time.perf_counter() - start)
+    return 1
+
+
+def bench_demosaic(width, height, nframes, timer):
+    import demosaic
+    raw = synthetic_sensor(width, height).grab()
+    for method in demosaic.METHODS:
+        engine = demosaic.Demosaic(raw.shape, "GRBG", method, np.float32)
+        for _ in range(nframes):
+            start = time.perf_counter()
+            engine(raw)
+            timer.lap("demosaic_" + method, time.perf_counter() - start)
+    return nframes * len(demosaic.METHODS)
+
+
+def bench_spec_to_rgb(width, height, nframes, timer):
+    with timer.stage("import"):
+        sys.path.insert(0, RAD2PHOTONICS_PATH)
+        import module2_tools
+    with timer.stage("load_cmf"):
+        module2_tools.ColourSystem.cmf
+    xyz = lambda x, y: np.array((x, y, 1 - x - y))
+    cs_srgb = module2_tools.ColourSystem(red=xyz(0.64, 0.33), green=xyz(0.30, 0.60), blue=xyz(0.15, 0.06),
+                                        white=xyz(0.3127, 0.3290))
+    rng = np.random.default_rng(0)
+    spectra = rng.random((NSPECTRA, len(cs_srgb.cmf)))
+    for spec in spectra:
+        start = time.perf_counter()
+        cs_srgb.spec_to_rgb(spec, out_fmt='html')
+        timer.lap("spec_to_rgb", time.perf_counter() - start)
+    with timer.stage("spec_to_rgb_batch"):
+        cs_srgb.spec_to_rgb_batch(spectra, out_fmt='html')
+    return NSPECTRA
+
+
+BENCHMARKS = {
+    "dark": bench_dark,
+    "noise": bench_noise,
+    "ptc": bench_ptc,
+    "tc2_read": bench_tc2_read,
+    "bayer": bench_bayer,
+    "demosaic": bench_demosaic,
+    "spec_to_rgb": bench_spec_to_rgb,
+}
+
+
+def run_case(case, width, height, nframes, results):
+    '''run one case (in a child process) and put its result dict on the results queue'''
+    result = {"case": case, "size": "%dx%d" % (width, height), "frames": nframes,
+              "rss_start_mb": peak_rss_mb()}
+    timer = StageTimer()
+    try:
+        start = time.perf_counter()
+        count = BENCHMARKS[case](width, height, nframes, timer)
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        result.update(status="error", error="%s: %s" % (type(e).__name__, e), traceback=traceback.format_exc())
+    else:
+        result.update(status="ok", frames=count, elapsed_s=elapsed, frames_per_s=count / elapsed)
+    result["stages"] = timer.report()
+    result["peak_rss_mb"] = peak_rss_mb()
+    results.put(result)
+
+
+def run_isolated(case, width, height, nframes):
+    '''run a case in a fresh process, so the peak RSS is the one of this case'''
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=run_case, args=(case, width, height, nframes, results))
+    process.start()
+    try:
+        result = results.get()
+    finally:
+        process.join()
+    return result
+
+
+def plan(cases, sizes, frames):
+    '''(case, width, height, nframes) of every run; cases that do not scale with size/frames run once'''
+    runs = []
+    for case in cases:
+        if case == "tc2_read":
+            runs.append((case, 16, 16, TC2_FRAMES))
+        elif case == "spec_to_rgb":
+            runs.append((case, 81, 1, NSPECTRA))
+        else:
+            for size in sizes:
+                width, height = (int(v) for v in size.lower().split("x"))
+                for nframes in (frames if case != "bayer" else [1]):
+                    runs.append((case, width, height, nframes))
+    return runs
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(base, new):
+    '''print the frames/s and peak RSS of new relative to base (two result files)'''
+    key = lambda r: (r["case"], r["size"], r["frames"])
+    old = {key(r): r for r in base["results"] if r["status"] == "ok"}
+    print("%-12s %-10s %7s %12s %12s %8s %10s" % ("case", "size", "frames", "base fps", "new fps", "speedup",
+                                                    "RSS ratio"))
+    for r in new["results"]:
+        if r["status"] != "ok" or key(r) not in old:
+            continue
+        b = old[key(r)]
+        rss = r["peak_rss_mb"] / b["peak_rss_mb"] if r["peak_rss_mb"] and b["peak_rss_mb"] else float("nan")
+        print("%-12s %-10s %7d %12.1f %12.1f %7.2fx %10.2f" % (r["case"], r["size"], r["frames"], b["frames_per_s"],
+                                                               r["frames_per_s"], r["frames_per_s"] / b["frames_per_s"],
+                                                               rss))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the acquisition and processing paths.")
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--sizes", nargs="+", default=SIZES, help="frame sizes WIDTHxHEIGHT")
+    parser.add_argument("--frames", nargs="+", type=int, default=FRAMES, help="frame counts")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", help="results JSON of a previous revision to compare against")
+    args = parser.parse_args(argv)
+
+    report = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+    for case, width, height, nframes in plan(args.cases, args.sizes, args.frames):
+        result = run_isolated(case, width, height, nframes)
+        report["results"].append(result)
+        if result["status"] == "ok":
+            print("%-12s %4dx%-4d %5d frames  %10.1f frames/s  peak RSS %s MB" % (
+                case, width, height, result["frames"], result["frames_per_s"], result["peak_rss_mb"]), file=sys.stderr)
+        else:
+            print("%-12s %4dx%-4d failed: %s" % (case, width, height, result["error"]), file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+    return report
+
+
+if __name__ == "__main__":
+    main()